@@ -7,5 +7,6 @@ from .ResponseErrors import (
     MethodNotAllowed,
     Conflict,
     UnprocessableContent,
+    TooManyRequests,
     InternalServerError
 )
\ No newline at end of file
@@ -1,2 +1,2 @@
-from .postgres import with_postgres
-from .redis import with_redis, get_redis_client
+from .postgres import with_postgres, with_replica
+from .redis import with_redis, get_redis_client, get_async_redis_client
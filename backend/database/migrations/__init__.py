@@ -0,0 +1,107 @@
+"""
+Versioned schema migrations.
+
+Every module in versions/ is one migration, applied in file name order and recorded in the
+schema_migrations table. Run them at deploy time with:
+
+    python -m database.migrations [upgrade|status]
+"""
+import importlib
+import pkgutil
+from types import ModuleType
+from typing import NamedTuple
+
+from sqlalchemy import Connection, text
+
+from database.postgres.connection import engine
+from logger import log
+
+MIGRATIONS_TABLE = "schema_migrations"
+LOCK_KEY = 7_340_021  # advisory lock held while migrating, so concurrent deploys apply each migration once
+
+
+class Migration(NamedTuple):
+    version: str
+    description: str
+    module: ModuleType
+
+    @property
+    def transactional(self) -> bool:
+        return getattr(self.module, "transactional", True)
+
+
+def discover() -> list[Migration]:
+    from . import versions
+
+    migrations = []
+    for info in sorted(pkgutil.iter_modules(versions.__path__), key=lambda m: m.name):
+        module = importlib.import_module(f"{versions.__name__}.{info.name}")
+        description = (module.__doc__ or info.name).strip().splitlines()[0]
+        migrations.append(Migration(info.name.split("_", 1)[0], description, module))
+    return migrations
+
+
+def _applied_versions(connection: Connection) -> set[str]:
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            version VARCHAR(32) PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """))
+    return set(connection.scalars(text(f"SELECT version FROM {MIGRATIONS_TABLE}")))
+
+
+def _record(connection: Connection, migration: Migration) -> None:
+    connection.execute(
+        text(f"INSERT INTO {MIGRATIONS_TABLE} (version, description) VALUES (:version, :description)"),
+        {"version": migration.version, "description": migration.description},
+    )
+
+
+def pending() -> list[Migration]:
+    with engine.begin() as connection:
+        applied = _applied_versions(connection)
+    return [migration for migration in discover() if migration.version not in applied]
+
+
+def upgrade() -> list[Migration]:
+    """Applies every pending migration and returns them."""
+    applied_now = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": LOCK_KEY})
+        try:
+            applied = _applied_versions(connection)
+            for migration in discover():
+                if migration.version in applied:
+                    continue
+
+                log(f"Applying migration {migration.version}: {migration.description}")
+                if migration.transactional:
+                    with engine.begin() as transaction:
+                        migration.module.upgrade(transaction)
+                        _record(transaction, migration)
+                else:
+                    # Statements like CREATE INDEX CONCURRENTLY can't run in a transaction block.
+                    # These migrations must be safe to re-run after a partial failure.
+                    migration.module.upgrade(connection)
+                    _record(connection, migration)
+                applied_now.append(migration)
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": LOCK_KEY})
+    return applied_now
+
+
+def create_index_concurrently(connection: Connection, name: str, definition: str) -> None:
+    """
+    Builds an index without blocking writes to the table.
+
+    A failed or interrupted concurrent build leaves an invalid index behind, that one is
+    dropped and built again. The definition is everything after the index name.
+    """
+    valid = connection.scalar(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name})
+    if valid:
+        return
+    if valid is False:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    connection.execute(text(f"CREATE INDEX CONCURRENTLY {name} {definition}"))
@@ -0,0 +1,18 @@
+import argparse
+
+from . import upgrade, pending
+
+parser = argparse.ArgumentParser(prog="python -m database.migrations", description="Applies pending schema migrations.")
+parser.add_argument("command", nargs="?", choices=["upgrade", "status"], default="upgrade")
+args = parser.parse_args()
+
+if args.command == "status":
+    migrations = pending()
+    print(f"{len(migrations)} pending migration(s)")
+    for migration in migrations:
+        print(f"  {migration.version}: {migration.description}")
+else:
+    migrations = upgrade()
+    for migration in migrations:
+        print(f"Applied {migration.version}: {migration.description}")
+    print(f"Schema is up to date, {len(migrations)} migration(s) applied")
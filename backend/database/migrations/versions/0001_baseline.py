@@ -0,0 +1,89 @@
+"""Baseline schema, as created by setup.py before migrations existed"""
+from sqlalchemy import Connection, text
+
+STATEMENTS = [
+    """
+    DO $$ BEGIN
+        CREATE TYPE role_enum AS ENUM ('OWNER', 'ADMIN', 'MANAGER', 'USER');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGSERIAL PRIMARY KEY,
+        full_name VARCHAR(255) NOT NULL,
+        dob DATE,
+        gender VARCHAR(20),
+        created_at TIMESTAMP DEFAULT now(),
+        updated_at TIMESTAMP DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS timesheets (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users (user_id),
+        machine VARCHAR(100),
+        description TEXT NOT NULL,
+        remark TEXT,
+        reviewed_by BIGINT REFERENCES users (user_id),
+        status VARCHAR(50),
+        date DATE NOT NULL,
+        start_time TIME NOT NULL,
+        end_time TIME NOT NULL,
+        created_at TIMESTAMP DEFAULT now(),
+        updated_at TIMESTAMP DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_accounts (
+        account_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+        username VARCHAR(150) NOT NULL UNIQUE,
+        password_hash VARCHAR(60) NOT NULL,
+        api_key VARCHAR(60),
+        role role_enum NOT NULL,
+        is_active BOOLEAN,
+        created_at TIMESTAMP DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_emails (
+        email_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+        email VARCHAR(255) NOT NULL UNIQUE,
+        is_primary BOOLEAN
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_primary_email ON user_emails (user_id) WHERE is_primary IS true",
+    """
+    CREATE TABLE IF NOT EXISTS user_phone_numbers (
+        phone_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+        phone_number VARCHAR(20) NOT NULL,
+        type VARCHAR(50),
+        is_primary BOOLEAN
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_primary_phone ON user_phone_numbers (user_id) WHERE is_primary IS true",
+    """
+    CREATE TABLE IF NOT EXISTS user_addresses (
+        address_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+        address_line1 VARCHAR(255) NOT NULL,
+        address_line2 VARCHAR(255),
+        city VARCHAR(100),
+        state VARCHAR(100),
+        country VARCHAR(100),
+        postal_code VARCHAR(20),
+        type VARCHAR(50),
+        is_primary BOOLEAN
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_primary_address ON user_addresses (user_id) WHERE is_primary IS true",
+]
+
+
+def upgrade(connection: Connection) -> None:
+    # Databases created through setup.py already have these, so every statement is conditional
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
@@ -0,0 +1,37 @@
+"""Store API keys as a lookup prefix and an HMAC instead of in plain text"""
+from sqlalchemy import Connection, text
+
+from logger import log
+from utils.passwords import get_api_key_prefix, hash_api_key
+
+
+def upgrade(connection: Connection) -> None:
+    connection.execute(text("ALTER TABLE user_accounts ADD COLUMN IF NOT EXISTS api_key_prefix VARCHAR(16)"))
+    connection.execute(text("ALTER TABLE user_accounts ADD COLUMN IF NOT EXISTS api_key_hash VARCHAR(64)"))
+    # Named like the constraint create_all makes, so tables created from the models are left alone
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS user_accounts_api_key_prefix_key ON user_accounts (api_key_prefix)"
+    ))
+
+    has_plain_keys = connection.scalar(text(
+        "SELECT EXISTS (SELECT FROM information_schema.columns "
+        "WHERE table_name = 'user_accounts' AND column_name = 'api_key')"
+    ))
+    if not has_plain_keys:
+        return
+
+    # Existing keys keep working, they are hashed and looked up by their leading characters
+    prefixes = set()
+    for account_id, api_key in connection.execute(text(
+        "SELECT account_id, api_key FROM user_accounts WHERE api_key IS NOT NULL AND api_key_hash IS NULL"
+    )):
+        prefix = get_api_key_prefix(api_key)
+        if prefix is None or prefix in prefixes:
+            log(f"API key of account {account_id} can't be converted, its owner has to generate a new one")
+            continue
+        prefixes.add(prefix)
+        connection.execute(
+            text("UPDATE user_accounts SET api_key_prefix = :prefix, api_key_hash = :hash WHERE account_id = :id"),
+            {"prefix": prefix, "hash": hash_api_key(api_key), "id": account_id},
+        )
+    connection.execute(text("ALTER TABLE user_accounts DROP COLUMN api_key"))
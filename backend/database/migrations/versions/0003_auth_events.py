@@ -0,0 +1,18 @@
+"""Add the auth_events audit table"""
+from sqlalchemy import Connection, text
+
+
+def upgrade(connection: Connection) -> None:
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS auth_events (
+            id BIGSERIAL PRIMARY KEY,
+            created_at TIMESTAMP NOT NULL,
+            client_host VARCHAR(64),
+            auth_type VARCHAR(20) NOT NULL,
+            event VARCHAR(20) NOT NULL,
+            user_id BIGINT,
+            reason TEXT
+        )
+    """))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_auth_events_created_at ON auth_events (created_at)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_auth_events_user_id ON auth_events (user_id)"))
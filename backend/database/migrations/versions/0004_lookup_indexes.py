@@ -0,0 +1,12 @@
+"""Index account lookups by user"""
+from sqlalchemy import Connection
+
+from database.migrations import create_index_concurrently
+
+# Built concurrently so existing tables stay writable during the build
+transactional = False
+
+
+def upgrade(connection: Connection) -> None:
+    # The timesheet indexes are built by 0005, on the partitioned table
+    create_index_concurrently(connection, "ix_user_accounts_user_id", "ON user_accounts (user_id)")
@@ -0,0 +1,68 @@
+"""
+Range partition timesheets by month on date
+
+The rows are copied and both indexes rebuilt in one transaction that holds an ACCESS EXCLUSIVE
+lock on the old table meanwhile, so timesheet reads as well as writes wait until it commits.
+Run it in a maintenance window sized to the table.
+"""
+from datetime import date
+
+from sqlalchemy import Connection, text
+
+from database.postgres.partitions import (
+    PARTITION_MONTHS_AHEAD, DEFAULT_PARTITION, month_start, add_months, create_partition
+)
+
+# Named rather than relying on both tables having the same column order
+COLUMNS = (
+    "id, user_id, machine, description, remark, reviewed_by, status, date, start_time, end_time, created_at, updated_at"
+)
+
+
+def upgrade(connection: Connection) -> None:
+    connection.execute(text("ALTER TABLE timesheets RENAME TO timesheets_unpartitioned"))
+    # Frees the primary key's name for the new table
+    connection.execute(text("ALTER INDEX IF EXISTS timesheets_pkey RENAME TO timesheets_unpartitioned_pkey"))
+    # Databases that ran an earlier 0004 have these on the old table, their names are reused on the partitioned one
+    connection.execute(text("DROP INDEX IF EXISTS ix_timesheets_user_date_start"))
+    connection.execute(text("DROP INDEX IF EXISTS ix_timesheets_pending"))
+
+    # The partition key has to be part of the primary key. Ids keep coming from the old sequence.
+    connection.execute(text("""
+        CREATE TABLE timesheets (
+            id BIGINT NOT NULL DEFAULT nextval('timesheets_id_seq'),
+            user_id BIGINT NOT NULL REFERENCES users (user_id),
+            machine VARCHAR(100),
+            description TEXT NOT NULL,
+            remark TEXT,
+            reviewed_by BIGINT REFERENCES users (user_id),
+            status VARCHAR(50),
+            date DATE NOT NULL,
+            start_time TIME NOT NULL,
+            end_time TIME NOT NULL,
+            created_at TIMESTAMP DEFAULT now(),
+            updated_at TIMESTAMP DEFAULT now(),
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date)
+    """))
+    connection.execute(text("ALTER SEQUENCE timesheets_id_seq OWNED BY timesheets.id"))
+    connection.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF timesheets DEFAULT"))
+
+    # Every month with rows gets its partition, so none are left in the default partition to block creating them later
+    current = month_start(date.today())
+    oldest, newest = connection.execute(text("SELECT min(date), max(date) FROM timesheets_unpartitioned")).one()
+    month = month_start(oldest) if oldest and oldest < current else current
+    last = max(month_start(newest), add_months(current, PARTITION_MONTHS_AHEAD)) if newest else add_months(current, PARTITION_MONTHS_AHEAD)
+    while month <= last:
+        create_partition(connection, month)
+        month = add_months(month, 1)
+
+    connection.execute(text(f"INSERT INTO timesheets ({COLUMNS}) SELECT {COLUMNS} FROM timesheets_unpartitioned"))
+    connection.execute(text("DROP TABLE timesheets_unpartitioned"))
+
+    # Indexes on the parent are created on every partition, including future ones.
+    # Listings filter on user_id and a date range, ordered by start time within a day.
+    connection.execute(text("CREATE INDEX ix_timesheets_user_date_start ON timesheets (user_id, date, start_time)"))
+    connection.execute(text(
+        "CREATE INDEX ix_timesheets_pending ON timesheets (date, start_time) WHERE status = 'Pending'"
+    ))
@@ -0,0 +1,10 @@
+"""Index users by (full_name, user_id) for keyset pagination sorted by name"""
+from sqlalchemy import Connection
+
+from database.migrations import create_index_concurrently
+
+transactional = False
+
+
+def upgrade(connection: Connection) -> None:
+    create_index_concurrently(connection, "ix_users_full_name_user_id", "ON users (full_name, user_id)")
@@ -0,0 +1,20 @@
+"""Full-text search on timesheet descriptions and trigram search on machines"""
+from sqlalchemy import Connection, text
+
+from database.postgres.tables import TEXT_SEARCH_CONFIG
+
+
+def upgrade(connection: Connection) -> None:
+    # Needs a role allowed to create extensions, or pg_trgm installed beforehand
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    # Adding a stored generated column rewrites every partition, so there's no point building the indexes concurrently
+    connection.execute(text(
+        "ALTER TABLE timesheets ADD COLUMN IF NOT EXISTS description_tsv tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('{TEXT_SEARCH_CONFIG}', description)) STORED"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_timesheets_description_tsv ON timesheets USING gin (description_tsv)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_timesheets_machine_trgm ON timesheets USING gin (machine gin_trgm_ops)"
+    ))
@@ -0,0 +1,42 @@
+"""Move timesheet machine names into a machines catalogue referenced by machine_id"""
+from sqlalchemy import Connection, text
+
+# Same normalization as utils.machines.normalize_machine_name
+NORMALIZED_MACHINE = r"regexp_replace(btrim(timesheets.machine), '\s+', ' ', 'g')"
+
+
+def upgrade(connection: Connection) -> None:
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS machines (
+            machine_id BIGSERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            created_at TIMESTAMP DEFAULT now()
+        )
+    """))
+    connection.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_machines_name ON machines (lower(name))"))
+    connection.execute(text("ALTER TABLE timesheets ADD COLUMN IF NOT EXISTS machine_id BIGINT REFERENCES machines (machine_id)"))
+
+    if connection.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'timesheets' AND column_name = 'machine')"
+    )):
+        _move_machine_names(connection)
+
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_timesheets_machine_date_start ON timesheets (machine_id, date, start_time)"
+    ))
+
+
+def _move_machine_names(connection: Connection) -> None:
+    connection.execute(text(f"""
+        INSERT INTO machines (name)
+        SELECT DISTINCT ON (lower({NORMALIZED_MACHINE})) {NORMALIZED_MACHINE} FROM timesheets
+        WHERE {NORMALIZED_MACHINE} <> ''
+        ORDER BY lower({NORMALIZED_MACHINE})
+        ON CONFLICT DO NOTHING
+    """))
+    connection.execute(text(f"""
+        UPDATE timesheets SET machine_id = machines.machine_id FROM machines
+        WHERE lower({NORMALIZED_MACHINE}) = lower(machines.name)
+    """))
+    connection.execute(text("DROP INDEX IF EXISTS ix_timesheets_machine_trgm"))
+    connection.execute(text("ALTER TABLE timesheets DROP COLUMN machine"))
@@ -1,7 +1,109 @@
+import inspect
+import time
+from contextvars import ContextVar
 from functools import wraps
-from .connection import DBSession, Session
+from os import getenv
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError, InterfaceError, SQLAlchemyError
+from starlette.requests import Request
+
+from logger import log_db_error
+from .connection import DBSession, AsyncDBSession, Session, AsyncSession, engine, async_engine, POOL_OPTIONS
+from .connection import async_replica_engine, AsyncReplicaSessionLocal, DB_MAX_OVERFLOW, SYNC_MAX_OVERFLOW
+from .pool import describe_pool
+from .query_stats import get_query_stats, reset_query_stats
+from .statements import get_statement_cache_stats
+
+# Clients that wrote within this window read from the primary, so they see their own writes despite replica lag
+READ_YOUR_WRITES_SECONDS = int(getenv('DB_READ_YOUR_WRITES_SECONDS', 5))
+READ_PRIMARY_COOKIE = "read_primary"
+# How long reads stay on the primary after the replica failed
+REPLICA_RETRY_SECONDS = int(getenv('DB_REPLICA_RETRY_SECONDS', 30))
+
+
+class _RequestSessions:
+    """The unit of work of the request being handled, see request_db."""
+    __slots__ = ("primary", "replica", "read_primary")
+
+    def __init__(self, primary: AsyncSession, read_primary: bool) -> None:
+        self.primary = primary
+        self.replica: Optional[AsyncSession] = None  # opened on the first replica read
+        self.read_primary = read_primary
+
+_request_sessions: ContextVar[Optional[_RequestSessions]] = ContextVar("request_sessions", default=None)
+_replica_down_until = 0.0
+
+
+@event.listens_for(Session, "after_flush")
+def _flag_write_on_flush(session, flush_context) -> None:
+    session.info["wrote"] = True
+
+@event.listens_for(Session, "do_orm_execute")
+def _flag_write_on_execute(orm_execute_state) -> None:
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+def after_commit(db: AsyncSession, callback: Callable[[], Awaitable[None]]) -> None:
+    """Runs the callback once the session's transaction is committed. Nothing runs if it is rolled back."""
+    db.info.setdefault("after_commit", []).append(callback)
+
+async def commit(db: AsyncSession) -> None:
+    await db.commit()
+    for callback in db.info.pop("after_commit", []):
+        await callback()
+
+async def request_db(request: Request) -> AsyncIterator[AsyncSession]:
+    """
+    FastAPI dependency opening one session per request.
+
+    Every with_postgres function called while handling the request reuses it, so a request
+    checks out one connection and runs one transaction, committed once the handler returns.
+    If the handler raises, the session is closed without committing and the transaction is rolled back.
+    with_replica functions share a second, read-only session on the replica.
+    """
+    async with AsyncDBSession() as session:
+        sessions = _RequestSessions(session, read_primary=READ_PRIMARY_COOKIE in request.cookies)
+        token = _request_sessions.set(sessions)
+        try:
+            yield session
+            await commit(session)
+            # Picked up by the read_your_writes middleware
+            request.state.db_wrote = session.info.get("wrote", False)
+        finally:
+            _request_sessions.reset(token)
+            if sessions.replica is not None:
+                await sessions.replica.close()
+
+async def release_connection() -> None:
+    """Commits the request's work so far, handing its connection back to the pool during slow non-DB work."""
+    sessions = _request_sessions.get()
+    if sessions is not None:
+        await commit(sessions.primary)
+
+
+def get_pool_stats() -> dict:
+    stats = {
+        "options": POOL_OPTIONS,
+        "async": describe_pool(async_engine.pool, DB_MAX_OVERFLOW),
+        "sync": describe_pool(engine.pool, SYNC_MAX_OVERFLOW),
+    }
+    if async_replica_engine is not None:
+        stats["replica"] = {**describe_pool(async_replica_engine.pool, DB_MAX_OVERFLOW), "available": _replica_available()}
+    return stats
+
 
 def with_postgres(func):
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if 'db' in kwargs:
+                return await func(*args, **kwargs)
+            return await _on_primary(func, args, kwargs)
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         if 'db' in kwargs:
@@ -9,4 +111,81 @@ def with_postgres(func):
 
         with DBSession() as session:
             return func(*args, db=session, **kwargs)
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+async def _on_primary(func, args, kwargs):
+    sessions = _request_sessions.get()
+    if sessions is not None:
+        return await func(*args, db=sessions.primary, **kwargs)
+
+    # Outside a request (scripts, shells) the call is its own unit of work
+    async with AsyncDBSession() as session:
+        result = await func(*args, db=session, **kwargs)
+        await commit(session)
+        return result
+
+
+def _replica_available() -> bool:
+    return async_replica_engine is not None and time.monotonic() >= _replica_down_until
+
+def _read_from_primary(sessions: Optional[_RequestSessions]) -> bool:
+    return not _replica_available() or (
+        sessions is not None and (sessions.read_primary or sessions.primary.info.get("wrote"))
+    )
+
+def read_session() -> AsyncDBSession:
+    """
+    A session of its own for reads outliving the request, like streamed responses.
+
+    Call it while handling the request, it picks the replica or the primary as with_replica would.
+    There's no fallback to the primary once the replica failed mid-read.
+    """
+    return AsyncDBSession(replica=not _read_from_primary(_request_sessions.get()))
+
+def with_replica(func):
+    """
+    Read-only variant of with_postgres that runs the function on the read replica.
+
+    Reads go to the primary instead when no replica is configured or it recently failed, when
+    the request has already written, or when the client wrote within READ_YOUR_WRITES_SECONDS.
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        global _replica_down_until
+        if 'db' in kwargs:
+            return await func(*args, **kwargs)
+
+        sessions = _request_sessions.get()
+        if _read_from_primary(sessions):
+            return await _on_primary(func, args, kwargs)
+
+        try:
+            if sessions is not None:
+                if sessions.replica is None:
+                    sessions.replica = AsyncReplicaSessionLocal()
+                return await func(*args, db=sessions.replica, **kwargs)
+
+            async with AsyncDBSession(replica=True) as session:
+                return await func(*args, db=session, **kwargs)
+        except (DBAPIError, OSError) as e:
+            # The function just reads, so running it again on the primary is safe
+            if sessions is not None and sessions.replica is not None:
+                await _discard_transaction(sessions.replica)
+            if _is_disconnect(e):
+                log_db_error(e, "Read replica unavailable, reading from the primary")
+                _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+            else:
+                # e.g. a statement timeout or a conflict with recovery, which says nothing about the replica's health
+                log_db_error(e, "Read failed on the replica, retrying it on the primary")
+            return await _on_primary(func, args, kwargs)
+    return wrapper
+
+def _is_disconnect(e: Exception) -> bool:
+    return isinstance(e, (InterfaceError, OSError)) or getattr(e, "connection_invalidated", False)
+
+async def _discard_transaction(session: AsyncSession) -> None:
+    """Rolls back the failed transaction, so later reads of the request can use the session again."""
+    try:
+        await session.rollback()
+    except (SQLAlchemyError, OSError):
+        pass
@@ -1,16 +1,21 @@
 from sqlalchemy import create_engine
 from sqlalchemy.engine.base import Engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base, DeclarativeMeta, Session
 from os import getenv
+from typing import Optional
 
 import logging
 from logger import log_db_event, log
 from logger.config import get_rotating_handler
+from .pool import InstrumentedQueuePool, InstrumentedAsyncQueuePool
+from .query_stats import instrument
 
 DB_NAME = getenv('POSTGRES_DB')
 DB_USER = getenv('POSTGRES_USER')
 DB_PASS = getenv('POSTGRES_PASSWORD')
 DB_HOST = getenv('POSTGRES_HOST')
+DB_REPLICA_HOST = getenv('POSTGRES_REPLICA_HOST')  # optional, reads stay on the primary without it
 
 missing_vars = [var_name for var_name, var_value in {
     'POSTGRES_DB': DB_NAME,
@@ -23,20 +28,76 @@ if missing_vars:
     raise EnvironmentError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}"
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}"
+ASYNC_REPLICA_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_REPLICA_HOST}/{DB_NAME}" if DB_REPLICA_HOST else None
 
-engine: Engine = create_engine(DATABASE_URL)
+# Connections the app may hold across all worker processes, leave headroom below the server's max_connections
+DB_CONNECTION_BUDGET = int(getenv('DB_CONNECTION_BUDGET', 80))
+WORKERS = int(getenv('WEB_CONCURRENCY', 1))
+# The sync engine only serves scripts and background threads, so it gets a small fixed share
+SYNC_POOL_SIZE = int(getenv('DB_SYNC_POOL_SIZE', 2))
+SYNC_MAX_OVERFLOW = 0
+
+# By default each worker's async pool may grow to its share of the budget, half of it kept open
+DB_POOL_SIZE = int(getenv('DB_POOL_SIZE', max(1, (DB_CONNECTION_BUDGET // WORKERS - SYNC_POOL_SIZE) // 2)))
+DB_MAX_OVERFLOW = int(getenv('DB_MAX_OVERFLOW', DB_POOL_SIZE))
+DB_POOL_TIMEOUT = float(getenv('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# An unreachable replica has to fail fast, reads then fall back to the primary
+DB_REPLICA_CONNECT_TIMEOUT = float(getenv('DB_REPLICA_CONNECT_TIMEOUT', 2))
+
+POOL_OPTIONS = {
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+# The sync engine serves scripts and background threads, request handlers use the async engine
+engine: Engine = create_engine(
+    DATABASE_URL,
+    poolclass=InstrumentedQueuePool,
+    pool_size=SYNC_POOL_SIZE,
+    max_overflow=SYNC_MAX_OVERFLOW,
+    **POOL_OPTIONS,
+)
 SessionLocal: sessionmaker = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+async_engine: AsyncEngine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=InstrumentedAsyncQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    **POOL_OPTIONS,
+)
+instrument(engine)
+instrument(async_engine.sync_engine)
+
+# Attributes can't be lazily reloaded without awaiting, so objects are not expired on commit
+AsyncSessionLocal: async_sessionmaker = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# The replica is a separate server, so its pool doesn't count against the primary's connection budget
+async_replica_engine: Optional[AsyncEngine] = None
+AsyncReplicaSessionLocal: Optional[async_sessionmaker] = None
+if ASYNC_REPLICA_URL:
+    async_replica_engine = create_async_engine(
+        ASYNC_REPLICA_URL,
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        connect_args={"timeout": DB_REPLICA_CONNECT_TIMEOUT},
+        **POOL_OPTIONS,
+    )
+    instrument(async_replica_engine.sync_engine)
+    AsyncReplicaSessionLocal = async_sessionmaker(bind=async_replica_engine, autoflush=False, expire_on_commit=False)
 Base: DeclarativeMeta = declarative_base()
 
 # Suppress noisy sub-loggers
 logging.getLogger('sqlalchemy.pool').setLevel(logging.WARNING)
 logging.getLogger('sqlalchemy.dialects').setLevel(logging.WARNING)
-logging.getLogger('sqlalchemy.engine.Engine').setLevel(logging.INFO)
-logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
-
-# Add rotating file handler only to core engine
-sqlalchemy_logger = logging.getLogger('sqlalchemy.engine')
-sqlalchemy_logger.addHandler(get_rotating_handler("db.log", logging.INFO))
+# Statements are timed by query_stats, which only logs slow or sampled ones
+logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+logging.getLogger('sqlalchemy.engine').addHandler(get_rotating_handler("db.log", logging.WARNING))
 
 class DBSession:
     """
@@ -66,3 +127,23 @@ class DBSession:
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
         self.db.close()
         log_db_event("Database closed")
+
+
+class AsyncDBSession:
+    """
+    Async counterpart of DBSession, used for coroutine functions.
+
+    Attributes:
+        db: An AsyncSession instance representing the current database session,
+            bound to the read replica when replica is True.
+    """
+    def __init__(self, replica: bool = False) -> None:
+        self.db: AsyncSession = AsyncReplicaSessionLocal() if replica else AsyncSessionLocal()
+        log_db_event("Database initialized")
+
+    async def __aenter__(self) -> AsyncSession:
+        return self.db
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.db.close()
+        log_db_event("Database closed")
@@ -0,0 +1,100 @@
+import json
+import logging
+from os import getenv
+from typing import NamedTuple, Optional
+
+from redis.asyncio import Redis as AsyncRedis
+from redis.exceptions import RedisError
+from sqlalchemy import Select, select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+from sqlalchemy.sql.visitors import InternalTraversal
+
+from database.redis import with_redis
+from logger import log
+
+COUNT_CACHE_SECONDS = int(getenv('COUNT_CACHE_SECONDS', 30))
+# Below this many estimated rows an exact count is cheap enough to run instead
+COUNT_ESTIMATE_THRESHOLD = int(getenv('COUNT_ESTIMATE_THRESHOLD', 10_000))
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) of a statement, keeping its bound parameters."""
+    inherit_cache = False
+    # Cache key of the wrapped statement, so the compiled EXPLAIN is cached as well
+    _traverse_internals = [("statement", InternalTraversal.dp_clauseelement)]
+
+    def __init__(self, statement: Select) -> None:
+        self.statement = statement
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element: Explain, compiler, **kw) -> str:
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def count_statement(statement: Select) -> Select:
+    return select(func.count()).select_from(statement.order_by(None).subquery())
+
+def estimate_statement(statement: Select) -> Explain:
+    return Explain(statement.order_by(None))
+
+
+async def exact_count(count: Select, db: AsyncSession, params: Optional[dict] = None) -> int:
+    """Runs a statement built by count_statement."""
+    return await db.scalar(count, params)
+
+async def estimate_count(explain: Explain, db: AsyncSession, params: Optional[dict] = None) -> int:
+    """
+    Runs a statement built by estimate_statement, returning the planner's row estimate.
+    Costs a plan, not a scan, but may be far off for selective filters.
+    """
+    plan = await db.scalar(explain, params)
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class CachedCount(NamedTuple):
+    total: Optional[int]  # None when nothing usable is cached
+    generation: Optional[int]  # of the listing's counts when read, None when Redis is unavailable
+
+def _generation_key(scope: str) -> str:
+    return f"count_generation:{scope}"
+
+@with_redis
+async def get_cached_count(scope: str, key: str, *, r: AsyncRedis) -> CachedCount:
+    """
+    The cached total of a filter set, unless rows of the listing (scope) were written since it was cached.
+    A cached 0 isn't used, on a first page that now has rows it would turn into a 404.
+    """
+    try:
+        generation, cached = await r.mget(_generation_key(scope), f"count:{key}")
+    except RedisError as e:
+        log(f"Count cache unavailable: {e}", logging.WARNING)
+        return CachedCount(None, None)
+
+    generation = int(generation or 0)
+    if cached is not None:
+        cached_generation, total = map(int, cached.split(b":"))
+        if cached_generation == generation and total > 0:
+            return CachedCount(total, generation)
+    return CachedCount(None, generation)
+
+@with_redis
+async def cache_count(key: str, total: int, generation: Optional[int], *, r: AsyncRedis) -> None:
+    """Caches a total counted under the generation get_cached_count returned, so a write meanwhile voids it."""
+    if generation is None:
+        return
+    try:
+        await r.set(f"count:{key}", f"{generation}:{total}", ex=COUNT_CACHE_SECONDS)
+    except RedisError as e:
+        log(f"Count cache unavailable: {e}", logging.WARNING)
+
+@with_redis
+async def invalidate_counts(scope: str, *, r: AsyncRedis) -> None:
+    """Voids every cached total of the listing, call it once a write to its rows is committed."""
+    try:
+        await r.incr(_generation_key(scope))
+    except RedisError as e:
+        log(f"Count cache unavailable: {e}", logging.WARNING)
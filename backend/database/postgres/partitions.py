@@ -0,0 +1,146 @@
+"""
+Maintenance of the monthly range partitions of timesheets.
+
+Partitions are created PARTITION_MONTHS_AHEAD months in advance, so inserts rarely land in
+the default partition. Rows that did, e.g. dated further ahead, move to their month's partition
+once it is created. With TIMESHEET_RETENTION_MONTHS set, older partitions are detached
+and moved to the archive schema, out of every query but still restorable. Run it by hand with:
+
+    python -m database.postgres.partitions
+"""
+import logging
+import threading
+from datetime import date
+from os import getenv
+from typing import Optional, Union
+
+from sqlalchemy import Connection, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from logger import log
+from .connection import DBSession
+
+PARENT_TABLE = "timesheets"
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+ARCHIVE_SCHEMA = "archive"
+
+PARTITION_MONTHS_AHEAD = int(getenv('PARTITION_MONTHS_AHEAD', 3))
+TIMESHEET_RETENTION_MONTHS = int(getenv('TIMESHEET_RETENTION_MONTHS', 0))  # 0 keeps every partition attached
+PARTITION_MAINTENANCE_INTERVAL = int(getenv('PARTITION_MAINTENANCE_INTERVAL', 12 * 60 * 60))
+PARTITION_LOCK_KEY = 7_340_022  # advisory lock, one worker maintains partitions at a time
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_y{month.year}m{month.month:02d}"
+
+
+def create_partition(db: Union[Session, Connection], month: date) -> None:
+    """
+    Creates the month's partition. Postgres refuses it while the default partition holds rows of
+    the month, so the default partition is detached meanwhile and those rows are moved over.
+    """
+    start, end = month.isoformat(), add_months(month, 1).isoformat()
+    in_month = f"date >= '{start}' AND date < '{end}'"
+    create = (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT_TABLE} "
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+    has_default = db.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": DEFAULT_PARTITION})
+    if not has_default or not db.scalar(text(f"SELECT EXISTS (SELECT FROM {DEFAULT_PARTITION} WHERE {in_month})")):
+        db.execute(text(create))
+        return
+
+    columns = _insertable_columns(db)
+    db.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {DEFAULT_PARTITION}"))
+    db.execute(text(create))
+    db.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {in_month} RETURNING {columns}) "
+        f"INSERT INTO {PARENT_TABLE} ({columns}) SELECT {columns} FROM moved"
+    ))
+    db.execute(text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+
+def _insertable_columns(db: Union[Session, Connection]) -> str:
+    """The parent's columns, generated ones left out as they can't be inserted."""
+    return db.scalar(text(
+        "SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum) FROM pg_attribute "
+        "WHERE attrelid = CAST(:table AS regclass) AND attnum > 0 AND NOT attisdropped AND attgenerated = ''"
+    ), {"table": PARENT_TABLE})
+
+def attached_partitions(db: Union[Session, Connection]) -> list[str]:
+    return list(db.scalars(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :parent"
+    ), {"parent": PARENT_TABLE}))
+
+
+def maintain_partitions(db: Session, today: Optional[date] = None) -> tuple[list[str], list[str]]:
+    """Creates upcoming partitions and archives expired ones. Returns the created and archived partition names."""
+    # DDL on the parent waits for running queries and blocks new ones meanwhile, so give up quickly and retry next run
+    db.execute(text("SET LOCAL lock_timeout = '5s'"))
+    if not db.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY}):
+        return [], []
+
+    current = month_start(today or date.today())
+    attached = set(attached_partitions(db))
+
+    created = []
+    for offset in range(PARTITION_MONTHS_AHEAD + 1):
+        month = add_months(current, offset)
+        if partition_name(month) not in attached:
+            # A month that fails, e.g. on the lock timeout, doesn't hold back the others
+            try:
+                with db.begin_nested():
+                    create_partition(db, month)
+            except SQLAlchemyError as e:
+                log(f"Creating partition {partition_name(month)} failed: {e}", logging.WARNING)
+                continue
+            created.append(partition_name(month))
+
+    archived = []
+    if TIMESHEET_RETENTION_MONTHS > 0:
+        oldest_kept = partition_name(add_months(current, -TIMESHEET_RETENTION_MONTHS))
+        db.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+        # Names sort chronologically, the default partition doesn't match the monthly pattern
+        for name in sorted(attached):
+            if name != DEFAULT_PARTITION and name < oldest_kept:
+                db.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+                db.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+                archived.append(name)
+
+    db.commit()
+    return created, archived
+
+
+def _run_partition_maintainer(stop: threading.Event) -> None:
+    while True:
+        try:
+            with DBSession() as db:
+                created, archived = maintain_partitions(db)
+            if created or archived:
+                log(f"Timesheet partitions created: {created}, archived: {archived}")
+        except SQLAlchemyError as e:
+            log(f"Timesheet partition maintenance failed: {e}", logging.WARNING)
+
+        if stop.wait(PARTITION_MAINTENANCE_INTERVAL):
+            return
+
+def start_partition_maintainer() -> threading.Event:
+    """Starts the background maintainer, which runs once right away. Setting the returned event stops it."""
+    stop = threading.Event()
+    threading.Thread(target=_run_partition_maintainer, args=(stop,), name="partition-maintainer", daemon=True).start()
+    return stop
+
+
+if __name__ == "__main__":
+    with DBSession() as session:
+        print("Created: {}, archived: {}".format(*maintain_partitions(session)))
@@ -0,0 +1,104 @@
+import bisect
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import Pool, QueuePool, AsyncAdaptedQueuePool
+
+from logger import log_db_event
+
+# Upper bounds of the checkout wait histogram, in milliseconds
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class PoolStats:
+    """Checkout wait times, overflow connections and timeouts of one pool."""
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)  # the last bucket counts waits beyond every bound
+        self.checkouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.overflow_connections = 0
+        self.timeouts = 0
+
+    def record_wait(self, wait_ms: float) -> None:
+        with self._lock:
+            self.buckets[bisect.bisect_left(WAIT_BUCKETS_MS, wait_ms)] += 1
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+
+    def record_overflow(self) -> None:
+        with self._lock:
+            self.overflow_connections += 1
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "avg_wait_ms": round(self.total_wait_ms / self.checkouts, 3) if self.checkouts else 0,
+                "max_wait_ms": round(self.max_wait_ms, 3),
+                "wait_histogram_ms": {
+                    **{f"le_{bound}": count for bound, count in zip(WAIT_BUCKETS_MS, self.buckets)},
+                    "inf": self.buckets[-1],
+                },
+                "overflow_connections": self.overflow_connections,
+                "timeouts": self.timeouts,
+            }
+
+
+class _InstrumentedPool:
+    """Mixin timing every checkout of a queue pool, including the pre-ping."""
+    stats: PoolStats
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.stats.record_timeout()
+            log_db_event("Connection pool timeout", self.status())
+            raise
+        finally:
+            self.stats.record_wait((time.perf_counter() - start) * 1000)
+
+    def _create_connection(self):
+        # The overflow counter is raised before connecting, so it is positive for connections beyond pool_size
+        if self.overflow() > 0:
+            self.stats.record_overflow()
+        return super()._create_connection()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(_InstrumentedPool, QueuePool):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPool, AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+
+def describe_pool(pool: Pool, max_overflow: int) -> dict:
+    """Live state of a pool next to its accumulated stats. max_overflow is the one the engine was created with."""
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": max_overflow,
+        "timeout": pool.timeout(),
+        **(pool.stats.snapshot() if isinstance(pool, _InstrumentedPool) else {}),
+    }
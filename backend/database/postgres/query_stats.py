@@ -0,0 +1,121 @@
+import random
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from os import getenv
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from logger import log_query
+
+SLOW_QUERY_MS = float(getenv('DB_SLOW_QUERY_MS', 200))
+QUERY_SAMPLE_RATE = float(getenv('DB_QUERY_SAMPLE_RATE', 0))
+QUERY_STATS_WINDOW = int(getenv('DB_QUERY_STATS_WINDOW', 1000))  # recent timings kept per fingerprint for percentiles
+QUERY_STATS_MAX_FINGERPRINTS = 1000
+
+OTHER_FINGERPRINT = "<other>"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"\$\d+|%\(\w+\)s|%s|\?|__\[POSTCOMPILE_\w+]")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_LIST = re.compile(r"(VALUES \(\?\.\.\.\))(?:\s*,\s*\(\?\.\.\.\))+", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    """
+    Normalizes a statement so every execution of the same query shares one key.
+
+    Literals and bound parameters become ?, and parameter lists of any length (IN lists,
+    multi-row VALUES) collapse to one form.
+    """
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _PLACEHOLDER.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    statement = _PLACEHOLDER_LIST.sub("(?...)", statement)
+    return _VALUES_LIST.sub(r"\1", statement)
+
+
+class _QueryStats:
+    __slots__ = ("count", "total_ms", "max_ms", "recent")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent: deque[float] = deque(maxlen=QUERY_STATS_WINDOW)
+
+    def add(self, duration_ms: float) -> None:
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.recent.append(duration_ms)
+
+    def snapshot(self, query: str) -> dict:
+        recent = sorted(self.recent)
+        return {
+            "query": query,
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.count, 3),
+            "p50_ms": round(recent[len(recent) // 2], 3),
+            "p99_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.99))], 3),
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+_stats: dict[str, _QueryStats] = {}
+_lock = threading.Lock()
+
+
+def record(statement: str, parameters, duration_ms: float) -> None:
+    key = fingerprint(statement)
+    with _lock:
+        stats = _stats.get(key)
+        if stats is None:
+            # Bounded so statements with unparameterized identifiers can't grow the table forever
+            if len(_stats) >= QUERY_STATS_MAX_FINGERPRINTS:
+                key = OTHER_FINGERPRINT
+            stats = _stats.setdefault(key, _QueryStats())
+        stats.add(duration_ms)
+
+    if duration_ms >= SLOW_QUERY_MS or (QUERY_SAMPLE_RATE and random.random() < QUERY_SAMPLE_RATE):
+        log_query(statement, parameters, duration_ms)
+
+
+def get_query_stats(sort_by: str = "total_ms", limit: int = 50) -> list[dict]:
+    with _lock:
+        snapshots = [stats.snapshot(query) for query, stats in _stats.items()]
+    return sorted(snapshots, key=lambda snapshot: snapshot[sort_by], reverse=True)[:limit]
+
+
+def reset_query_stats() -> None:
+    with _lock:
+        _stats.clear()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    duration_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+    record(statement, parameters, duration_ms)
+
+def _handle_error(context) -> None:
+    # after_cursor_execute doesn't fire for failed statements
+    starts = context.connection.info.get("query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument(engine: Engine) -> None:
+    """Times every statement the engine runs. Async engines are instrumented through their sync_engine."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+from os import getenv
+from typing import Callable, Hashable
+
+STATEMENT_CACHE_SIZE = int(getenv('DB_STATEMENT_CACHE_SIZE', 500))
+
+
+class StatementCache:
+    """
+    Built statements keyed by their shape, e.g. which filters are set and how the rows are paged.
+
+    Reusing one statement object per shape skips building it again, and SQLAlchemy memoizes its
+    cache key, so the compiled SQL is found without traversing the statement. Only bind values
+    change between executions. Hits and misses are counted per name.
+    """
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._statements: OrderedDict[Hashable, object] = OrderedDict()
+        self._counts: dict[str, list[int]] = {}  # name -> [hits, misses]
+        self._lock = threading.Lock()
+
+    def get[T](self, name: str, key: Hashable, build: Callable[[], T]) -> T:
+        key = (name, key)
+        with self._lock:
+            counts = self._counts.setdefault(name, [0, 0])
+            statement = self._statements.get(key)
+            if statement is not None:
+                counts[0] += 1
+                self._statements.move_to_end(key)
+                return statement
+
+            counts[1] += 1
+            statement = self._statements[key] = build()
+            while len(self._statements) > self.maxsize:
+                self._statements.popitem(last=False)
+            return statement
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._statements),
+                "maxsize": self.maxsize,
+                "by_name": {
+                    name: {"hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 4)}
+                    for name, (hits, misses) in self._counts.items()
+                },
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._statements.clear()
+            self._counts.clear()
+
+
+statement_cache = StatementCache(STATEMENT_CACHE_SIZE)
+
+
+def get_statement_cache_stats() -> dict:
+    return statement_cache.snapshot()
@@ -1,37 +1,70 @@
 from sqlalchemy import (
     Column, String, BigInteger, Boolean, Date, ForeignKey, TIMESTAMP,
-    func, Index, Text, Time, Enum
+    func, Index, Text, Time, Enum, Computed, select
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.orm import relationship, declarative_base, deferred, column_property
 from Enums import Roles
 
 Base = declarative_base()
 
+TEXT_SEARCH_CONFIG = "english"
+
+class MachineTable(Base):
+    __tablename__ = "machines"
+
+    machine_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    name = Column(String(100), nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+    __table_args__ = (
+        Index("uq_machines_name", func.lower(name), unique=True),
+    )
+
 class TimesheetTable(Base):
     __tablename__ = "timesheets"
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, ForeignKey("users.user_id"), nullable=False)
     # Core activity details
-    machine = Column(String(100))  # e.g. Machine name / ID
-    description = Column(Text, nullable=False)
+    machine_id = Column(BigInteger, ForeignKey("machines.machine_id"))
+    description = Column(Text, nullable=False, info={"tsvector": "description_tsv"})
+    # Maintained by Postgres for full-text search, deferred so listings don't load it
+    description_tsv = deferred(Column(TSVECTOR, Computed(f"to_tsvector('{TEXT_SEARCH_CONFIG}', description)", persisted=True)))
     remark = Column(Text)
     # Tracking & Review
     reviewed_by = Column(BigInteger, ForeignKey("users.user_id"))  # another user (admin/manager)
     status = Column(String(50), default="Pending")  # Pending, Approved, Rejected
     # Time tracking
-    date = Column(Date, nullable=False)  # Work date
+    date = Column(Date, primary_key=True)  # Work date, also the partition key
     start_time = Column(Time, nullable=False)
     end_time = Column(Time, nullable=False)
     # Meta
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
 
+    # Name of the machine, looked up by primary key for each row loaded
+    machine = column_property(
+        select(MachineTable.name).where(MachineTable.machine_id == machine_id).scalar_subquery(),
+        info={"nullable": True},
+    )
+
     # Relationships
     user = relationship("UserTable", foreign_keys=[user_id], back_populates="timesheets")
     reviewer = relationship("UserTable", foreign_keys=[reviewed_by])
 
+    # Created by migrations, declared here so the models match the schema.
+    # Monthly partitions are managed by database.postgres.partitions
+    # noinspection PyUnresolvedReferences
+    __table_args__ = (
+        Index("ix_timesheets_user_date_start", "user_id", "date", "start_time"),
+        Index("ix_timesheets_pending", "date", "start_time", postgresql_where=status == "Pending"),
+        Index("ix_timesheets_description_tsv", "description_tsv", postgresql_using="gin"),
+        Index("ix_timesheets_machine_date_start", "machine_id", "date", "start_time"),
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
+
 # -----------------------
 # 1. Users
 # -----------------------
@@ -52,6 +85,10 @@ class UserTable(Base):
     addresses = relationship("UserAddress", back_populates="user", cascade="all, delete-orphan")
     timesheets = relationship("TimesheetTable", foreign_keys=[TimesheetTable.user_id], back_populates="user", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_users_full_name_user_id", "full_name", "user_id"),
+    )
+
     @hybrid_property
     def role(self):
         return self.account.role if self.account else None
@@ -63,10 +100,11 @@ class UserAccount(Base):
     __tablename__ = "user_accounts"
 
     account_id = Column(BigInteger, primary_key=True, autoincrement=True)
-    user_id = Column(BigInteger, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(BigInteger, ForeignKey("users.user_id", ondelete="CASCADE"), nullable=False, index=True)
     username = Column(String(150), unique=True, nullable=False)
     password_hash = Column(String(60), nullable=False)
-    api_key = Column(String(60), nullable=True)
+    api_key_prefix = Column(String(16), unique=True, nullable=True)  # Public part of the key, used for lookup
+    api_key_hash = Column(String(64), nullable=True)  # HMAC-SHA256 of the full key
     role = Column(Enum(Roles, name="role_enum"), nullable=False)  # Index for faster queries
     is_active = Column(Boolean, default=True)
     created_at = Column(TIMESTAMP, server_default=func.now())
@@ -153,3 +191,18 @@ class UserAddress(Base):
             postgresql_where=is_primary.is_(True),
         ),
     )
+
+
+# -----------------------
+# 6. Auth Events (audit trail)
+# -----------------------
+class AuthEventTable(Base):
+    __tablename__ = "auth_events"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    created_at = Column(TIMESTAMP, nullable=False, index=True)
+    client_host = Column(String(64))
+    auth_type = Column(String(20), nullable=False)
+    event = Column(String(20), nullable=False)
+    user_id = Column(BigInteger, index=True)  # No foreign key, failed attempts may not map to a user
+    reason = Column(Text)
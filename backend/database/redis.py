@@ -1,5 +1,7 @@
 import redis
+import redis.asyncio
 import os
+import inspect
 from functools import wraps
 
 host = os.getenv('REDIS_HOST')
@@ -7,8 +9,19 @@ if not host:
     raise EnvironmentError("HOST environment variable not set")
 
 _redis_client = redis.Redis(host=host, port=6379, db=0)
+_async_redis_client = redis.asyncio.Redis(host=host, port=6379, db=0)
 
 def with_redis(func):
+    # Coroutine functions get the asyncio client, everything else the blocking one
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if 'r' in kwargs:
+                return await func(*args, **kwargs)
+
+            return await func(*args, r=_async_redis_client, **kwargs)
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
         # Allow passing custom client if needed
@@ -19,4 +32,7 @@ def with_redis(func):
     return wrapper
 
 def get_redis_client() -> redis.Redis:
-    return _redis_client
\ No newline at end of file
+    return _redis_client
+
+def get_async_redis_client() -> redis.asyncio.Redis:
+    return _async_redis_client
@@ -5,6 +5,12 @@ from .app import (
     log
 )
 
+from .audit import (
+    start_audit_writer,
+    stop_audit_writer,
+    get_audit_stats
+)
+
 from .db import (
     log_query,
     log_db_error,
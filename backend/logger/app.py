@@ -1,25 +1,42 @@
 import logging
+from datetime import datetime
 from typing import Any
 
 from fastapi import Request
 
 from Enums import AuthTypes, AuthEvents
 from Exceptions import ResponseError, InternalServerError
+from .audit import enqueue
 from .config import get_rotating_handler
 
 app_logger = logging.getLogger("app_logger")
 app_logger.setLevel(logging.DEBUG)
 app_logger.addHandler(get_rotating_handler("app.log"))
 
+def _make_record(level: int, msg: str) -> logging.LogRecord:
+    # Points the record at whoever called log_request / log_auth_event, as app_logger.log would
+    pathname, lineno, func, _ = app_logger.findCaller(stacklevel=3)
+    return app_logger.makeRecord(app_logger.name, level, pathname, lineno, msg, None, None, func)
+
 def log_request(request: Request, status_code, duration_ms) -> None:
+    if not app_logger.isEnabledFor(logging.INFO):
+        return
     msg = f"{request.client.host} - \"{request.method} {request.url.path}?{request.url.query}\" - {duration_ms:.2f}ms - status {status_code}"
-    app_logger.info(msg)
+    enqueue(app_logger, _make_record(logging.INFO, msg))
 
 def log_auth_event(request: Request, auth_type: AuthTypes, auth_event: AuthEvents, user_id: int | None, reason: str) -> None:
     msg = f"{request.client.host} - {auth_type.value} - status:{auth_event.value} - user:{user_id} - reason:{reason if reason else 'NIL'}"
     level = logging.DEBUG if auth_type is AuthTypes.SESSION else logging.INFO
     level = level if auth_event is AuthEvents.SUCCESS else logging.WARN
-    app_logger.log(level, msg)
+    record = _make_record(level, msg)
+    enqueue(app_logger, record, {
+        "created_at": datetime.fromtimestamp(record.created),
+        "client_host": request.client.host,
+        "auth_type": auth_type.value,
+        "event": auth_event.value,
+        "user_id": user_id,
+        "reason": reason,
+    })
 
 def log_error(request: Request, error: ResponseError, level: logging = logging.WARN) -> None:
     msg = f"{request.client.host} - \"{request.method} {request.url.path}?{request.url.query}\" - Exception: {type(error).__name__}"
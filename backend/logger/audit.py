@@ -0,0 +1,121 @@
+import logging
+import threading
+from collections import deque
+from os import getenv
+from typing import Optional
+
+AUDIT_QUEUE_SIZE = int(getenv('AUDIT_QUEUE_SIZE', 10_000))
+AUDIT_BATCH_SIZE = int(getenv('AUDIT_BATCH_SIZE', 500))
+AUDIT_FLUSH_INTERVAL = float(getenv('AUDIT_FLUSH_INTERVAL', 0.5))
+AUDIT_DB_ENABLED = getenv('AUDIT_DB_ENABLED', 'false').lower() == 'true'
+
+# deque.append/popleft are atomic, so request threads never wait on a lock to enqueue
+_queue: deque[tuple[logging.LogRecord, Optional[dict]]] = deque()
+_writer: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+# Best-effort counters, updated without locking
+_stats = {
+    "enqueued": 0,
+    "dropped": 0,
+    "written": 0,
+    "db_written": 0,
+    "db_failed": 0,
+}
+
+
+def enqueue(logger: logging.Logger, record: logging.LogRecord, auth_event: Optional[dict] = None) -> None:
+    """
+    Hands a log record (and optionally an auth event row) to the background writer.
+
+    Records are dropped and counted once the queue is full rather than slowing requests down.
+    Without a running writer (scripts, shells) the record is written synchronously.
+    """
+    if _writer is None:
+        logger.handle(record)
+        return
+
+    if len(_queue) >= AUDIT_QUEUE_SIZE:
+        _stats["dropped"] += 1
+        return
+
+    _queue.append((record, auth_event))
+    _stats["enqueued"] += 1
+
+
+def _drain(batch_size: int) -> list[tuple[logging.LogRecord, Optional[dict]]]:
+    batch = []
+    while len(batch) < batch_size:
+        try:
+            batch.append(_queue.popleft())
+        except IndexError:
+            break
+    return batch
+
+
+def _write_to_db(rows: list[dict]) -> None:
+    # Imported lazily, the database package itself logs through this package
+    from sqlalchemy import insert
+    from database.postgres import DBSession
+    from database.postgres.tables import AuthEventTable
+
+    with DBSession() as db:
+        db.execute(insert(AuthEventTable), rows)  # executed as multi-row INSERTs
+        db.commit()
+
+
+def _write_batch(batch: list[tuple[logging.LogRecord, Optional[dict]]]) -> None:
+    app_logger = logging.getLogger("app_logger")
+    for record, _ in batch:
+        app_logger.handle(record)
+    _stats["written"] += len(batch)
+
+    rows = [auth_event for _, auth_event in batch if auth_event is not None]
+    if AUDIT_DB_ENABLED and rows:
+        try:
+            _write_to_db(rows)
+            _stats["db_written"] += len(rows)
+        except Exception as e:
+            _stats["db_failed"] += len(rows)
+            app_logger.error(f"Failed to persist {len(rows)} auth events: {e}")
+
+
+def _run() -> None:
+    reported_drops = 0
+    while True:
+        stopping = _stop.wait(AUDIT_FLUSH_INTERVAL)
+        while batch := _drain(AUDIT_BATCH_SIZE):
+            _write_batch(batch)
+
+        if _stats["dropped"] > reported_drops:
+            logging.getLogger("app_logger").warning(
+                f"Audit queue full, dropped {_stats['dropped'] - reported_drops} events"
+            )
+            reported_drops = _stats["dropped"]
+
+        if stopping:
+            return
+
+
+def start_audit_writer() -> None:
+    global _writer
+    _stop.clear()
+    _writer = threading.Thread(target=_run, name="audit-writer", daemon=True)
+    _writer.start()
+
+
+def stop_audit_writer() -> None:
+    """Flushes everything still queued and stops the writer."""
+    global _writer
+    if _writer is None:
+        return
+    _stop.set()
+    _writer.join()
+    _writer = None
+    # Anything enqueued while the writer was finishing
+    while batch := _drain(AUDIT_BATCH_SIZE):
+        _write_batch(batch)
+
+
+def get_audit_stats() -> dict:
+    return {**_stats, "queue_depth": len(_queue)}
@@ -1,5 +1,6 @@
 from starlette.middleware.cors import CORSMiddleware
 from routes import app
+from utils.compression import CompressionMiddleware
 
 origins = [
     "http://localhost:5173",
@@ -7,6 +8,8 @@ origins = [
     "http://192.168.1.20:5173",  # your real LAN IP here
 ]
 
+# Added first so CORS wraps it, compression only sees the application's responses
+app.add_middleware(CompressionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,  # or ["*"] for all origins (less secure)
@@ -1,5 +1,5 @@
 from datetime import datetime, date, time
-from typing import Optional
+from typing import Optional, Literal
 
 from pydantic import BaseModel, PrivateAttr, Field
 
@@ -22,10 +22,15 @@ class User(__default_model):
 class UserDetail(User):
     role: Roles
 
+class Machine(__default_model):
+    machine_id: int
+    name: str
+
 class Timesheet(__default_model):
     id: int
     user_id: int
-    machine: str
+    machine_id: Optional[int]
+    machine: Optional[str]
     description: Optional[str]
     remark: Optional[str]
     reviewed_by: Optional[int]
@@ -35,4 +40,10 @@ class Timesheet(__default_model):
 
 class TimesheetWithUser(Timesheet):
     user: User
-    user_id: int = Field(..., exclude=True)
\ No newline at end of file
+    user_id: int = Field(..., exclude=True)
+
+class ReportJob(__default_model):
+    job_id: str  # content address of the report, see modules.reports
+    status: Literal["pending", "ready", "failed"]
+    user_id: int
+    period: str
@@ -1,2 +1,2 @@
 from .params import QueryParams, TimeSheetParams
-from .payload import LoginPayload, RegisterPayload, TimesheetPayload
\ No newline at end of file
+from .payload import LoginPayload, RegisterPayload, TimesheetPayload, TimesheetReportPayload
\ No newline at end of file
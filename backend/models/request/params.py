@@ -1,56 +1,274 @@
-from datetime import datetime, date
-from typing import Optional, Literal, Self, Callable, Any
+import hashlib
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime, time
+from typing import Optional, Literal, Self, Callable, Any, AsyncIterator, ClassVar, Hashable, Iterable, NamedTuple, Sequence
 
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, Field, field_validator, model_validator, PrivateAttr
-from sqlalchemy import Column, BinaryExpression, ColumnElement
-from sqlalchemy.orm import Query as SQLQuery
+from sqlalchemy import Column, ColumnElement, Select, Float, Integer, bindparam, func, literal_column, tuple_
+from sqlalchemy.engine import Row
+from sqlalchemy.sql.elements import BindParameter, Label
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from database.postgres.counts import count_statement, estimate_statement, exact_count, estimate_count
+from database.postgres.counts import CachedCount, get_cached_count, cache_count, invalidate_counts, COUNT_ESTIMATE_THRESHOLD
+from database.postgres.statements import statement_cache
 from database.postgres.tables import UserAccount, UserPhoneNumber, UserTable
-from database.postgres.tables import TimesheetTable
+from database.postgres.tables import TimesheetTable, TEXT_SEARCH_CONFIG
+from Exceptions import NotFound
 from models.response import Pagination
+from utils.machines import get_machine_index
+
+
+class Filter(NamedTuple):
+    """A filter on one query parameter, built around a bind parameter so one statement serves every value."""
+    condition: Callable[[BindParameter], ColumnElement[bool]]
+    bind: Callable[[Any], Any] = lambda value: value  # the bound value for a parameter value
+    expanding: bool = False  # binds a list, for IN
 
 
 class QueryParams(BaseModel):
     page: int = Field(1, ge=1)
     limit: int = Field(10, ge=1)
+    # Opaque next_cursor of a previous page, seeks past its last row instead of skipping page - 1 pages
+    cursor: Optional[str] = None
+    # exact counts come from a cache or ride along with the page query, estimate uses the planner's
+    # estimate for large results, none skips counting
+    count: Literal["exact", "estimate", "none"] = "exact"
 
     _pagination: Optional[Pagination] = PrivateAttr(None)
+    _cursor_values: Optional[list] = PrivateAttr(None)
+
+    _filters: ClassVar[dict[str, Filter]] = {}
 
-    _filters: dict[str, Callable] = {}
+    # Rows are ordered by sort_by (or _default_sort) and then by _id_column, which makes every sort key unique.
+    # Computed sort keys are labeled expressions, selected alongside the entity.
+    _id_column: ClassVar[Column]
+    _default_sort: ClassVar[tuple[Column, ...]] = ()
 
     @property
     def pagination(self):
         return self._pagination
 
-    def apply_filters(self, base_query: SQLQuery) -> SQLQuery:
-        """Apply all defined filters from _filters dict."""
-        query = base_query
-        for attr, condition_fn in self._filters.items():
-            value = getattr(self, attr, None)
+    def keyset(self) -> list[Column | Label]:
+        sort = [self.sort_by] if self.sort_by is not None else list(self._default_sort)
+        # Read off the class, mapped attributes are descriptors that would bind to this instance
+        return sort + [type(self)._id_column]
+
+    @staticmethod
+    def sort_expression(column: Column | Label) -> ColumnElement:
+        # Row comparisons can't order NULLs, so nullable columns sort as empty strings.
+        # Column properties don't carry a nullable flag, they declare it in their info
+        nullable = getattr(column, "nullable", None)
+        if nullable is None:
+            nullable = getattr(column, "info", {}).get("nullable", False)
+        return func.coalesce(column, "") if nullable else column
+
+    def _cursor_sort(self) -> str:
+        return ",".join(column.key for column in self.keyset())
+
+    def encode_cursor(self, row: Row) -> str:
+        values = []
+        for column in self.keyset():
+            value = row._mapping[column.key]
+            if value is None:
+                value = ""  # only nullable columns hold NULLs, and they sort as empty strings
+            values.append(value.isoformat() if isinstance(value, (date, time)) else value)
+        payload = json.dumps({"sort": self._cursor_sort(), "after": values}, separators=(",", ":"))
+        return urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    @model_validator(mode="after")
+    def decode_cursor(self) -> Self:
+        if self.cursor is None:
+            return self
+        try:
+            payload = json.loads(urlsafe_b64decode(self.cursor + "=" * (-len(self.cursor) % 4)))
+            keyset = self.keyset()
+            if payload["sort"] != self._cursor_sort() or len(payload["after"]) != len(keyset):
+                raise ValueError("cursor belongs to a different sort order")
+
+            values = []
+            for column, value in zip(keyset, payload["after"]):
+                python_type = column.type.python_type
+                values.append(python_type.fromisoformat(value) if python_type in (date, time, datetime) else python_type(value))
+            self._cursor_values = values
+        except (ValueError, TypeError, KeyError):
+            raise RequestValidationError([
+                {
+                    "loc": ("query", "cursor"),
+                    "msg": "Invalid cursor",
+                    "type": "value_error"
+                }
+            ])
+        return self
+
+    def filter_values(self) -> dict[str, Any]:
+        """Bind values of the filters set on this request, keyed by filter name."""
+        values = {}
+        for name, filter_ in self._filters.items():
+            value = getattr(self, name, None)
             if value is not None:
-                query = query.filter(condition_fn(value))
-        return query
+                values[name] = filter_.bind(value)
+        return values
+
+    def apply_filters(self, statement: Select, names: Iterable[str]) -> Select:
+        """Applies the named filters from _filters, their values bound on execution."""
+        for name in names:
+            filter_ = self._filters[name]
+            statement = statement.where(filter_.condition(bindparam(name, expanding=filter_.expanding)))
+        return statement
+
+    def apply_sort(self, statement: Select) -> Select:
+        return statement.order_by(*(self.sort_expression(column) for column in self.keyset()))
+
+    def apply_page(self, statement: Select) -> Select:
+        """
+        Selects the requested page of a sorted statement.
+
+        With a cursor the page starts right after the cursor's row through a row value
+        comparison, so it costs the same however deep it is. One row more than the limit is
+        fetched to tell whether there is a next page. Values are bound on execution, see page_values.
+        """
+        if self._cursor_values is not None:
+            keyset = self.keyset()
+            after = tuple_(*(bindparam(f"after_{i}", type_=column.type) for i, column in enumerate(keyset)))
+            statement = statement.where(tuple_(*(self.sort_expression(column) for column in keyset)) > after)
+        else:
+            statement = statement.offset(bindparam("page_offset", type_=Integer))
+        return statement.limit(bindparam("page_limit", type_=Integer))
+
+    def page_values(self) -> dict[str, Any]:
+        values = {"page_limit": self.limit + 1}
+        if self._cursor_values is not None:
+            values.update((f"after_{i}", value) for i, value in enumerate(self._cursor_values))
+        else:
+            values["page_offset"] = (self.page - 1) * self.limit
+        return values
+
+    def cached[T](self, build: Callable[[], T], *shape: Hashable) -> T:
+        """The statement build returns, built once per shape and reused after, see StatementCache."""
+        return statement_cache.get(type(self).__name__, shape, build)
+
+    @classmethod
+    async def invalidate_counts(cls) -> None:
+        """Voids the cached totals of every filter set of this listing, after a committed write to its rows."""
+        await invalidate_counts(cls.__name__)
 
-    def apply_sort(self, query: SQLQuery) -> SQLQuery:
-        if self.sort_by:
-            query = query.order_by(self.sort_by)
-        return query
+    def count_key(self) -> str:
+        """Identifies the filter set, so every page and sort order of a listing shares one cached count."""
+        filters = self.model_dump(mode="json", exclude_none=True, exclude={"page", "limit", "cursor", "sort_by", "count"})
+        digest = hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+        return f"{type(self).__name__}:{digest}"
 
-    def build(self, base_query: SQLQuery) -> SQLQuery:
-        query = self.apply_filters(base_query)
-        self._pagination = Pagination(total_items=query.count(), limit=self.limit, page=self.page)
-        query = self.apply_sort(query)
-        return query.offset((self.page - 1) * self.limit).limit(self.limit)
+    async def fetch(self, statement: Select, db: AsyncSession) -> list[Row]:
+        """
+        Filters, sorts and pages the statement, returning its rows and setting pagination.
+        The sort columns must be among the selected ones, rows may carry extra columns after them.
+
+        Selecting only the columns the response model needs returns plain rows, skipping ORM
+        entities and the identity map. The statements run are cached by which filters are set,
+        the sort order and the paging mode, keyed on the statement passed in, so it should be
+        built once at module level rather than per call.
+        """
+        values = self.filter_values()
+        filtered = self.cached(lambda: self.apply_filters(statement, values), statement, *values)
+        total_items, estimated = None, False
+        cached = CachedCount(None, None)
+
+        if self.count == "estimate":
+            explain = self.cached(lambda: estimate_statement(filtered), filtered, "estimate")
+            estimate = await estimate_count(explain, db, values)
+            if estimate >= COUNT_ESTIMATE_THRESHOLD:
+                total_items, estimated = estimate, True
+        if self.count != "none" and total_items is None:
+            cached = await get_cached_count(type(self).__name__, self.count_key())
+            total_items = cached.total
+        counted = self.count != "none" and total_items is None
+
+        # The window is computed before LIMIT, so the page query returns the total in the same round trip.
+        # After a cursor only the remaining rows are left to count, so those pages count separately.
+        window_count = counted and self._cursor_values is None
+        page = self.cached(
+            lambda: self.page_statement(filtered, window_count),
+            filtered, self._cursor_sort(), self._cursor_values is not None, window_count
+        )
+
+        rows = (await db.execute(page, values | self.page_values())).all()
+
+        if window_count and rows:
+            total_items = rows[0].total_items
+        elif window_count and self.page == 1:
+            total_items = 0
+        if counted and total_items is None:
+            count = self.cached(lambda: count_statement(filtered), filtered, "count")
+            total_items = await exact_count(count, db, values)  # cursor pages, and offsets past the last row
+        if counted:
+            await cache_count(self.count_key(), total_items, cached.generation)
+
+        if self.count == "none" and not rows and self.cursor is None and self.page == 1:
+            raise NotFound("No data found")
+
+        # A cached or estimated total can be behind the rows just read (one past the page included), it never claims fewer
+        if total_items is not None:
+            rows_so_far = len(rows) + (0 if self.cursor else (self.page - 1) * self.limit)
+            total_items = max(total_items, rows_so_far)
+
+        self._pagination = Pagination(
+            total_items=total_items,
+            estimated=estimated,
+            limit=self.limit,
+            page=None if self.cursor else self.page,
+        )
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            self._pagination.next_cursor = self.encode_cursor(rows[-1])
+        return rows
+
+    async def stream(self, statement: Select, db: AsyncSession, chunk_rows: int) -> AsyncIterator[Sequence[Row]]:
+        """
+        Filters and sorts the statement, yielding every row in chunks read through a server-side cursor.
+        Paging and counting parameters are ignored.
+        """
+        values = self.filter_values()
+        filtered = self.cached(lambda: self.apply_filters(statement, values), statement, *values)
+        ordered = self.cached(lambda: self.apply_sort(filtered), filtered, self._cursor_sort())
+        result = await db.stream(ordered, values, execution_options={"yield_per": chunk_rows})
+        async for rows in result.partitions():
+            yield rows
+
+    def page_statement(self, filtered: Select, window_count: bool) -> Select:
+        page = self.apply_page(self.apply_sort(filtered))
+        page = page.add_columns(*(column for column in self.keyset() if isinstance(column, Label)))
+        if window_count:
+            page = page.add_columns(func.count().over().label("total_items"))
+        return page
 
     @staticmethod
-    def eq(column: Column) -> Callable[[Any], ColumnElement[bool]]:
-        return lambda value: column == value
+    def eq(column: Column) -> Filter:
+        return Filter(lambda param: column == param)
 
     # noinspection SpellCheckingInspection
     @staticmethod
-    def ilike(column: Column) -> Callable[[Any], BinaryExpression[bool]]:
-        return lambda value: column.ilike(f"%{value}%")
+    def ilike(column: Column) -> Filter:
+        return Filter(lambda param: column.ilike(param), lambda value: f"%{value}%")
+
+    @staticmethod
+    def search(column: Column) -> Filter:
+        """
+        Text filter using the operator the column's index can serve.
+
+        Columns naming a tsvector column in their info get full-text search, anything else falls back to ILIKE.
+        """
+        if (tsvector := column.info.get("tsvector")) is not None:
+            vector = getattr(column.class_, tsvector)
+            return Filter(lambda param: vector.op("@@")(text_query(param)))
+        return QueryParams.ilike(column)
+
+
+def text_query(value: ColumnElement) -> ColumnElement:
+    # The config is inlined, asyncpg can't bind regconfig parameters
+    return func.websearch_to_tsquery(literal_column(f"'{TEXT_SEARCH_CONFIG}'::regconfig"), value)
 
 class UserParams(QueryParams):
     name: Optional[str] = None
@@ -60,6 +278,8 @@ class UserParams(QueryParams):
 
     sort_by: Optional[Literal["name", "gender"]] = None
 
+    _id_column = UserTable.user_id
+
     _filters = {
         "name": QueryParams.ilike(UserTable.full_name),
         "gender": QueryParams.eq(UserTable.gender),
@@ -76,24 +296,48 @@ class UserParams(QueryParams):
         match v:
             case "name":
                 return UserTable.full_name
+            case "gender":
+                return UserTable.gender
             case _:
                 raise ValueError(f"Invalid sort_by value: {v!r}")
 
 class TimeSheetParams(QueryParams):
     user_id: Optional[int] = None
-    machine: Optional[str] = None
+    machine_id: Optional[int] = None
+    machine: Optional[str] = None  # prefix of any word of the machine name
     description: Optional[str] = None
     from_date: Optional[date] = None
     to_date: Optional[date] = None
 
     sort_by: Optional[Literal["machine", "start_time", "end_time"]] = None
 
+    _id_column = TimesheetTable.id
+    # Follows ix_timesheets_user_date_start, so listings for a user seek on the index
+    _default_sort = (TimesheetTable.date, TimesheetTable.start_time)
+
     _filters = {
         "user_id": QueryParams.eq(TimesheetTable.user_id),
-        "machine": QueryParams.ilike(TimesheetTable.machine),
-        "description": QueryParams.ilike(TimesheetTable.description)
+        "machine_id": QueryParams.eq(TimesheetTable.machine_id),
+        # Names are matched in the machine index, leaving the query an integer key lookup
+        "machine": Filter(
+            lambda param: TimesheetTable.machine_id.in_(param),
+            lambda value: get_machine_index().search(value),
+            expanding=True,
+        ),
+        "description": QueryParams.search(TimesheetTable.description),
+        # Plain predicates on the partition key, so only the partitions in range are scanned
+        "from_date": Filter(lambda param: TimesheetTable.date >= param),
+        "to_date": Filter(lambda param: TimesheetTable.date <= param),
     }
 
+    def keyset(self) -> list[Column | Label]:
+        if self.description is not None and self.sort_by is None:
+            # Best matches first, ascending order on the negated rank keeps the keyset comparison a plain >
+            # Bound to the description filter's value
+            relevance = func.ts_rank(TimesheetTable.description_tsv, text_query(bindparam("description")), type_=Float)
+            return [(-relevance).label("relevance"), TimesheetTable.id]
+        return super().keyset()
+
     @model_validator(mode="after")
     def check_date(self) -> Self:
         if self.from_date or self.to_date:
@@ -119,19 +363,10 @@ class TimeSheetParams(QueryParams):
 
         match v:
             case "machine":
-                return TimesheetTable.machine_name
+                return TimesheetTable.machine
             case "start_time":
                 return TimesheetTable.start_time
             case "end_time":
                 return TimesheetTable.end_time
             case _:
                 raise ValueError(f"Invalid sort_by value: {v!r}")
-
-    def build(self, base_query: SQLQuery) -> SQLQuery:
-        query = base_query
-        if self.from_date and self.to_date:
-            query = base_query.filter(
-                TimesheetTable.start_time >= self.from_date,
-                TimesheetTable.start_time <= datetime.combine(self.to_date, datetime.max.time())
-            )
-        return super().build(query)
@@ -12,6 +12,9 @@ class LoginPayload(BaseModel):
 class UpdateRolesPayload(BaseModel):
     role: Roles
 
+class UpdateAccountStatePayload(BaseModel):
+    is_active: bool
+
 class RegisterPayload(BaseModel):
     full_name: str
     username: str
@@ -58,4 +61,8 @@ class TimesheetPayload(BaseModel):
     def check_time_order(self) -> Self:
         if self.start_time >= self.end_time:
             raise ValueError("start_time must be earlier than end_time")
-        return self
\ No newline at end of file
+        return self
+
+class TimesheetReportPayload(BaseModel):
+    user_id: Optional[int] = None  # defaults to the current user
+    period: constr(pattern=r"^\d{4}-(0[1-9]|1[0-2])$")  # YYYY-MM
@@ -2,25 +2,34 @@ from http import HTTPStatus
 from typing import Optional, Dict, Union, Self
 
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, model_validator, computed_field, Field
+from pydantic import BaseModel, TypeAdapter, model_validator, computed_field, Field
 
 from Exceptions import ResponseError, UnprocessableContent, NotFound
 from utils.session import delete_cookie
 
 
 class Pagination(BaseModel):
-    total_items: int = Field(..., ge=0)
+    total_items: Optional[int] = Field(None, ge=0)  # None when the client opted out of counting
+    estimated: bool = False  # total_items is the planner's estimate rather than an exact count
     limit: int = Field(..., gt=0)
-    page: int = Field(..., gt=0)
+    page: Optional[int] = Field(None, gt=0)  # None when paging by cursor
+    next_cursor: Optional[str] = None
 
     @computed_field
-    def total_pages(self) -> int:
+    def total_pages(self) -> Optional[int]:
+        if self.total_items is None:
+            return None
+        return (self.total_items + self.limit - 1) // self.limit
+
+    # Checked on creation rather than in total_pages, so serializing the response can't fail
+    @model_validator(mode='after')
+    def check_page(self) -> Self:
         if self.total_items == 0:
             raise NotFound("No data found")
-        pages = (self.total_items + self.limit - 1) // self.limit
-        if pages < self.page:
+        pages = self.total_pages
+        if pages is not None and not self.estimated and self.page is not None and pages < self.page:
             raise UnprocessableContent(f"Page number {self.page} is out of range. Valid pages are 1 to {pages}.")
-        return pages
+        return self
 
 
 class ResponseModel[T](BaseModel):
@@ -48,7 +57,17 @@ class ResponseModel[T](BaseModel):
     def jsonresponse(self, **kwargs) -> JSONResponse:
         if 'status_code' not in kwargs:
             kwargs['status_code'] = self.status
-        return JSONResponse(self.model_dump(exclude_none=True, mode='json'), **kwargs)
+        # Encoded straight to bytes, the same JSON JSONResponse would render from model_dump(mode='json')
+        return EncodedJSONResponse(_response_adapter.dump_json(self, exclude_none=True), **kwargs)
+
+
+_response_adapter = TypeAdapter(ResponseModel)
+
+
+class EncodedJSONResponse(JSONResponse):
+    """A JSONResponse for content that is already encoded JSON."""
+    def render(self, content: bytes) -> bytes:
+        return content
 
 
 class Respond:
@@ -61,7 +80,10 @@ class Respond:
             pagination: Optional[Pagination] = None,
             **kwargs
     ) -> JSONResponse:
-        return ResponseModel(status=status, message=message, data=data, pagination=pagination).jsonresponse(**kwargs)
+        # Built without validation, data and pagination are validated models already and the status is a success
+        return ResponseModel.model_construct(
+            status=status, message=message, data=data, pagination=pagination
+        ).jsonresponse(**kwargs)
 
     @staticmethod
     def __send_error(status: HTTPStatus, message: str,
@@ -76,6 +98,10 @@ class Respond:
     def created[T](message: str, data: Optional[T] = None, **kwargs) -> JSONResponse:
         return Respond.__send_response(HTTPStatus.CREATED, message, data, **kwargs)
 
+    @staticmethod
+    def accepted[T](message: str, data: Optional[T] = None, **kwargs) -> JSONResponse:
+        return Respond.__send_response(HTTPStatus.ACCEPTED, message, data, **kwargs)
+
     @staticmethod
     def bad_request(message: str) -> JSONResponse:
         return Respond.__send_error(HTTPStatus.BAD_REQUEST, message)
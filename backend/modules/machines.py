@@ -0,0 +1,32 @@
+from typing import List
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert
+
+from database import with_postgres
+from database.postgres import AsyncSession, after_commit
+from database.postgres.tables import MachineTable
+from models.models import Machine
+from utils.machines import get_machine_index, refresh_machine_index, invalidate_machines, normalize_machine_name
+
+
+async def suggest_machines(prefix: str, limit: int) -> List[Machine]:
+    index = await refresh_machine_index()
+    return [Machine(machine_id=machine_id, name=index.names[machine_id]) for machine_id in index.search(prefix, limit)]
+
+@with_postgres
+async def resolve_machine(name: str, *, db: AsyncSession) -> int:
+    """Id of the machine with the given name, ignoring case and extra whitespace. Unknown machines are created."""
+    name = normalize_machine_name(name)
+    machine_id = get_machine_index().find(name)
+    if machine_id is not None:
+        return machine_id
+
+    machine_id = await db.scalar(
+        insert(MachineTable).values(name=name).on_conflict_do_nothing().returning(MachineTable.machine_id)
+    )
+    if machine_id is None:
+        # Created since the index was loaded
+        return await db.scalar(select(MachineTable.machine_id).where(func.lower(MachineTable.name) == name.lower()))
+    after_commit(db, invalidate_machines)
+    return machine_id
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date
+from os import getenv
+from typing import Optional
+
+from redis.asyncio import Redis as AsyncRedis
+from sqlalchemy import select
+
+from Exceptions import NotFound, TooManyRequests, Conflict
+from database import with_replica, with_redis, get_redis_client
+from database.postgres import AsyncSession
+from database.postgres.partitions import add_months
+from database.postgres.tables import TimesheetTable, UserTable
+from logger import log
+from models.models import ReportJob
+from utils.reports import ReportRow, render_timesheet_report
+
+# Rendering is CPU bound Python, so it runs in processes of its own rather than next to the event loop
+REPORT_WORKERS = int(getenv('REPORT_WORKERS', 2))
+# Reports allowed to wait for a worker before new ones are rejected
+REPORT_QUEUE_LIMIT = int(getenv('REPORT_QUEUE_LIMIT', 8))
+REPORT_CACHE_SECONDS = int(getenv('REPORT_CACHE_SECONDS', 7 * 24 * 60 * 60))
+# A pending job older than this is given up on, e.g. when its worker died, and may be requested again
+REPORT_JOB_SECONDS = int(getenv('REPORT_JOB_SECONDS', 10 * 60))
+REPORT_LAYOUT_VERSION = 1  # bump when the rendering changes, so cached PDFs aren't served
+
+_report_pool: Optional[ProcessPoolExecutor] = None
+_report_pool_lock = threading.Lock()
+_report_slots = threading.BoundedSemaphore(REPORT_WORKERS + REPORT_QUEUE_LIMIT)
+
+
+def _job_key(job_id: str) -> str:
+    return f"report:{job_id}"
+
+def _pdf_key(job_id: str) -> str:
+    return f"report:{job_id}:pdf"
+
+
+def _get_report_pool() -> ProcessPoolExecutor:
+    global _report_pool
+    with _report_pool_lock:
+        if _report_pool is None:
+            # Forking a process running threads and an event loop isn't safe, spawned workers only import utils.reports
+            _report_pool = ProcessPoolExecutor(REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _report_pool
+
+def stop_report_workers() -> None:
+    with _report_pool_lock:
+        if _report_pool is not None:
+            _report_pool.shutdown(wait=False, cancel_futures=True)
+
+def _submit_report_job(employee: str, period: str, rows: list[ReportRow]) -> Future[bytes]:
+    """Queues a rendering on the report pool, failing fast when the pool is saturated."""
+    if not _report_slots.acquire(blocking=False):
+        raise TooManyRequests("Too many reports are being generated, please try again shortly")
+    try:
+        future = _get_report_pool().submit(render_timesheet_report, employee, period, rows)
+    except BaseException:
+        _report_slots.release()
+        raise
+    future.add_done_callback(lambda _: _report_slots.release())
+    return future
+
+
+@with_replica
+async def _fetch_report_data(user_id: int, month: date, *, db: AsyncSession) -> tuple[str, list[ReportRow]]:
+    employee = await db.scalar(select(UserTable.full_name).where(UserTable.user_id == user_id))
+    if employee is None:
+        raise NotFound("User not found")
+
+    timesheets = await db.execute(
+        select(
+            TimesheetTable.date, TimesheetTable.start_time, TimesheetTable.end_time,
+            TimesheetTable.machine, TimesheetTable.description, TimesheetTable.status,
+        )
+        # Range on the partition key, only the month's partition is read
+        .where(TimesheetTable.user_id == user_id, TimesheetTable.date >= month, TimesheetTable.date < add_months(month, 1))
+        .order_by(TimesheetTable.date, TimesheetTable.start_time, TimesheetTable.id)
+    )
+    rows = [
+        (day.isoformat(), start.isoformat(), end.isoformat(), machine, description, status)
+        for day, start, end, machine, description, status in timesheets
+    ]
+    return employee, rows
+
+def _report_id(user_id: int, period: str, employee: str, rows: list[ReportRow]) -> str:
+    """
+    Content address of a report. The data it is rendered from is its version,
+    so any change to the period's timesheets makes a new report.
+    """
+    content = json.dumps([REPORT_LAYOUT_VERSION, user_id, period, employee, rows], separators=(",", ":"))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _store_report(job: ReportJob, future: Future[bytes]) -> None:
+    # Runs on the pool's result thread, so it uses the blocking client
+    r = get_redis_client()
+    try:
+        pdf = future.result()
+    except Exception as e:
+        log(f"Report {job.job_id} failed: {e!r}", logging.ERROR)
+        job.status = "failed"
+        r.set(_job_key(job.job_id), job.model_dump_json(), ex=REPORT_JOB_SECONDS)
+        return
+
+    job.status = "ready"
+    with r.pipeline() as pipe:
+        pipe.set(_pdf_key(job.job_id), pdf, ex=REPORT_CACHE_SECONDS)
+        pipe.set(_job_key(job.job_id), job.model_dump_json(), ex=REPORT_CACHE_SECONDS)
+        pipe.execute()
+
+@with_redis
+async def request_timesheet_report(user_id: int, period: str, *, r: AsyncRedis) -> ReportJob:
+    """
+    Report of the user's timesheets for the period (YYYY-MM), rendered in the background.
+
+    Reports are cached under their content address, so a repeated request returns the
+    ready or pending job as long as the timesheets it covers are unchanged.
+    """
+    employee, rows = await _fetch_report_data(user_id, date.fromisoformat(f"{period}-01"))
+    job = ReportJob(job_id=_report_id(user_id, period, employee, rows), status="pending", user_id=user_id, period=period)
+
+    # Only one worker renders a report, the others find its job
+    while not await r.set(_job_key(job.job_id), job.model_dump_json(), ex=REPORT_JOB_SECONDS, nx=True):
+        existing = await r.get(_job_key(job.job_id))
+        if existing is None:
+            continue  # expired or dropped after a rejected submission since, claim it again
+        existing = ReportJob.model_validate_json(existing)
+        if existing.status != "failed":
+            return existing
+        await r.set(_job_key(job.job_id), job.model_dump_json(), ex=REPORT_JOB_SECONDS)
+        break
+
+    try:
+        future = _submit_report_job(employee, period, rows)
+    except TooManyRequests:
+        await r.delete(_job_key(job.job_id))
+        raise
+    future.add_done_callback(lambda done: _store_report(job.model_copy(), done))
+    return job
+
+@with_redis
+async def get_report_job(job_id: str, *, r: AsyncRedis) -> ReportJob:
+    job = await r.get(_job_key(job_id))
+    if job is None:
+        raise NotFound("Report not found")
+    return ReportJob.model_validate_json(job)
+
+@with_redis
+async def get_report_pdf(job_id: str, *, r: AsyncRedis) -> bytes:
+    pdf = await r.get(_pdf_key(job_id))
+    if pdf is None:
+        if (await get_report_job(job_id)).status == "pending":
+            raise Conflict("Report is still being generated")
+        raise NotFound("Report not found")
+    return pdf
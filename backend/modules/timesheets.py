@@ -1,35 +1,79 @@
-from typing import List, Union
+import csv
+import io
+from os import getenv
+from typing import AsyncIterator, List, Literal, Union
 
+from pydantic import TypeAdapter
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session, Query as SQLQuery
+from sqlalchemy.orm import joinedload
 
 from Exceptions import InternalServerError
-from database import with_postgres
+from database import with_postgres, with_replica
+from database.postgres import AsyncSession, AsyncDBSession, after_commit, read_session
 from database.postgres.tables import TimesheetTable, UserTable
 from models.models import Timesheet, TimesheetWithUser
 from models.request import TimeSheetParams, TimesheetPayload
+from modules.machines import resolve_machine
+from utils.machines import refresh_machine_index
 
+TIMESHEETS = select(*(getattr(TimesheetTable, field) for field in Timesheet.model_fields))
+_timesheets = TypeAdapter(list[Timesheet])
+_timesheet = TypeAdapter(Timesheet)
 
-@with_postgres
-def fetch_timesheets(params: TimeSheetParams, *, db: Session) -> List[Timesheet]:
-    query: SQLQuery = params.build(db.query(
-        TimesheetTable
-    ))
+EXPORT_CHUNK_ROWS = int(getenv('EXPORT_CHUNK_ROWS', 1000))  # rows fetched from the cursor and encoded at a time
 
-    return [Timesheet.model_validate(timesheet) for timesheet in query.all()]
 
-@with_postgres
-def fetch_timesheet(timesheet_id: int, *, db: Session) -> Union[Timesheet, None]:
-    timesheet: TimesheetTable = db.query(TimesheetTable).filter(TimesheetTable.id == timesheet_id).one_or_none()
+@with_replica
+async def fetch_timesheets(params: TimeSheetParams, *, db: AsyncSession) -> List[Timesheet]:
+    if params.machine is not None:
+        await refresh_machine_index()  # the machine filter resolves names through it
+    return _timesheets.validate_python([row._mapping for row in await params.fetch(TIMESHEETS, db)])
+
+@with_replica
+async def fetch_timesheet(timesheet_id: int, *, db: AsyncSession) -> Union[Timesheet, None]:
+    timesheet: TimesheetTable = await db.scalar(
+        select(TimesheetTable).options(joinedload(TimesheetTable.user)).where(TimesheetTable.id == timesheet_id)
+    )
     if timesheet is None:
         return None
     return TimesheetWithUser.model_validate(timesheet)
 
+async def export_timesheets(params: TimeSheetParams, export_format: Literal["csv", "ndjson"]) -> AsyncIterator[bytes]:
+    """
+    Every timesheet matching the filters, encoded chunk by chunk as the returned iterator is consumed.
+    Memory use is bounded by EXPORT_CHUNK_ROWS, however many rows match.
+    """
+    if params.machine is not None:
+        await refresh_machine_index()
+    # A session of its own, the request's is closed before a streamed response is sent
+    return _export(read_session(), params, export_format)
+
+async def _export(session: AsyncDBSession, params: TimeSheetParams, export_format: str) -> AsyncIterator[bytes]:
+    encode = _encode_csv if export_format == "csv" else _encode_ndjson
+    if export_format == "csv":
+        yield _encode_csv([tuple(Timesheet.model_fields)])
+    async with session as db:
+        async for rows in params.stream(TIMESHEETS, db, EXPORT_CHUNK_ROWS):
+            yield encode(rows)
+
+def _encode_csv(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+def _encode_ndjson(rows) -> bytes:
+    # Same objects as the listing returns, one per line
+    return b"".join(
+        _timesheet.dump_json(timesheet, exclude_none=True) + b"\n"
+        for timesheet in _timesheets.validate_python([row._mapping for row in rows])
+    )
+
 @with_postgres
-def create_timesheet(activity: TimesheetPayload, *, db: Session) -> int:
+async def create_timesheet(activity: TimesheetPayload, *, db: AsyncSession) -> int:
     activity = TimesheetTable(
         user_id=activity.user_id,
-        machine=activity.machine,
+        machine_id=await resolve_machine(activity.machine, db=db) if activity.machine else None,
         description=activity.description,
         date=activity.date,
         start_time=activity.start_time,
@@ -38,13 +82,14 @@ def create_timesheet(activity: TimesheetPayload, *, db: Session) -> int:
 
     try:
         db.add(activity)
-        db.commit()
-        db.refresh(activity)
+        await db.flush()
+        after_commit(db, TimeSheetParams.invalidate_counts)
         return activity.id
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise InternalServerError("Database error while creating user")
 
 
 if __name__ == "__main__":
-    print(fetch_timesheets())
\ No newline at end of file
+    import asyncio
+    print(asyncio.run(fetch_timesheets(TimeSheetParams())))
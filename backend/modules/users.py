@@ -1,26 +1,34 @@
+import hmac
 from functools import wraps
 from typing import Optional
 
-from psycopg2.errors import NotNullViolation
+from pydantic import TypeAdapter
+from sqlalchemy import select, update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
 
 from Enums import Roles
 from Exceptions import NotFound, Unauthorized, Conflict, InternalServerError, Forbidden, BadRequest
-from database import with_postgres
-from database.postgres import Session
+from database import with_postgres, with_replica
+from database.postgres import AsyncSession, after_commit, release_connection
 from database.postgres.tables import UserTable, UserAccount
 from logger import log_db_error
 from models.models import User, UserDetail
 from models.request import RegisterPayload
 from models.request.params import UserParams
-from utils.passwords import generate_hash, verify_hash, generate_api_key
+from utils.cache import invalidate_user, api_key_cache, cache_enabled
+from utils.session import update_session_role, update_session_active, delete_user_sessions
+from utils.tokens import revoke_user_tokens
+from utils.passwords import generate_hash_async, verify_hash_async, needs_rehash, generate_api_key, get_api_key_prefix, hash_api_key
+
+USERS = select(*(getattr(UserTable, field) for field in User.model_fields))
+_users = TypeAdapter(list[User])
 
 
 def model_validate(func):
     @wraps(func)
-    def wrapper(*args, **kwargs):
-        val = func(*args, **kwargs)
+    async def wrapper(*args, **kwargs):
+        val = await func(*args, **kwargs)
 
         if val is None:
             return None
@@ -38,125 +46,187 @@ def model_validate(func):
 
 
 
-@with_postgres
+@with_replica
 @model_validate
-def fetch_user(user_id: int, *, db: Session) -> User:
-    data = db.query(UserTable).options(joinedload(UserTable.account)).filter(UserTable.user_id == user_id).first()
+async def fetch_user(user_id: int, *, db: AsyncSession) -> User:
+    data = await db.scalar(select(UserTable).options(joinedload(UserTable.account)).where(UserTable.user_id == user_id))
 
     if data is None:
         raise NotFound("User not found")
 
     return data
 
-@with_postgres
-def login_user(username: str, password: str, *, db: Session) -> User:
-    data: UserAccount = db.query(UserAccount).filter(UserAccount.username == username).one_or_none()
+async def login_user(username: str, password: str) -> User:
+    # The connection is handed back before hashing so slow logins don't hold it
+    data = await _fetch_credentials(username)
+    await release_connection()
 
     if data is None:
         raise NotFound("User not found")
-    elif verify_hash(password, data.password_hash):
-        return fetch_user(data.user_id, db=db)
-    else:
+    elif data.is_active is False:
+        raise Forbidden("Account is disabled")
+    elif not await verify_hash_async(password, data.password_hash):
         raise Unauthorized("Incorrect password")
 
+    if needs_rehash(data.password_hash):
+        await _update_password_hash(data.user_id, await generate_hash_async(password))
+    return await fetch_user(data.user_id)
+
 @with_postgres
-def validate_api_key(api_key: str, *, db: Session) -> int:
-    data = db.query(UserAccount.user_id).filter(UserAccount.api_key == api_key).one_or_none()
-    if data is None:
+async def _fetch_credentials(username: str, *, db: AsyncSession):
+    result = await db.execute(
+        select(UserAccount.user_id, UserAccount.password_hash, UserAccount.is_active)
+        .where(UserAccount.username == username)
+    )
+    return result.one_or_none()
+
+@with_postgres
+async def _update_password_hash(user_id: int, password_hash: str, *, db: AsyncSession) -> None:
+    await db.execute(update(UserAccount).where(UserAccount.user_id == user_id).values(password_hash=password_hash))
+
+async def validate_api_key(api_key: str) -> int:
+    prefix = get_api_key_prefix(api_key)
+    if prefix is None:
+        raise Unauthorized("Invalid API key")
+
+    digest = hash_api_key(api_key)
+    use_cache = cache_enabled()
+    if use_cache and (user_id := api_key_cache.get(digest)) is not None:
+        return user_id
+
+    user_id = await _fetch_api_key_owner(prefix, digest)
+    if use_cache:
+        api_key_cache.set(digest, user_id)
+    return user_id
+
+@with_postgres
+async def _fetch_api_key_owner(prefix: str, digest: str, *, db: AsyncSession) -> int:
+    result = await db.execute(
+        select(UserAccount.user_id, UserAccount.api_key_hash, UserAccount.is_active)
+        .where(UserAccount.api_key_prefix == prefix)
+    )
+    data = result.one_or_none()
+    if data is None or not hmac.compare_digest(data.api_key_hash, digest):
         raise Unauthorized("Invalid API key")
+    elif data.is_active is False:
+        raise Forbidden("Account is disabled")
     return data.user_id
 
 @with_postgres
-def get_api_key(user_id: int, *, db: Session) -> str:
-    data = db.query(UserAccount.api_key).filter(UserAccount.user_id == user_id).one_or_none()
-    if data.api_key is None:
-        return update_api_key(user_id, db=db)
-    return data.api_key
+async def get_api_key(user_id: int, *, db: AsyncSession) -> str:
+    """Generates a key if the user has none. Existing keys are only stored hashed, so just the prefix is returned."""
+    api_key_prefix = await db.scalar(select(UserAccount.api_key_prefix).where(UserAccount.user_id == user_id))
+    if api_key_prefix is None:
+        return await update_api_key(user_id, db=db)
+    return f"{api_key_prefix}.****"
 
 @with_postgres
-def update_api_key(user_id: int, *, delete: bool = False, db: Session) -> str:
+async def update_api_key(user_id: int, *, delete: bool = False, db: AsyncSession) -> str:
     key = generate_api_key() if not delete else None
+    values = {
+        "api_key_prefix": get_api_key_prefix(key) if key else None,
+        "api_key_hash": hash_api_key(key) if key else None,
+    }
 
     try:
-        db.query(UserAccount).filter(UserAccount.user_id == user_id).update({"api_key": key})
+        await db.execute(update(UserAccount).where(UserAccount.user_id == user_id).values(values))
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         log_db_error(e.detail)
         raise InternalServerError("Database error while updating api key")
 
-    db.commit()
+    after_commit(db, lambda: invalidate_user(user_id))
     return key
 
-@with_postgres
-@model_validate
-def fetch_users(params: UserParams, *, db: Session) -> list[User]:
-    return params.build(db.query(UserTable)).all()
+@with_replica
+async def fetch_users(params: UserParams, *, db: AsyncSession) -> list[User]:
+    return _users.validate_python([row._mapping for row in await params.fetch(USERS, db)])
 
-@with_postgres
-def does_user_exist(user_id: int, *, db: Session) -> bool:
-    return bool(db.query(UserTable.user_id).filter(UserTable.user_id == user_id).one_or_none())
+@with_replica
+async def does_user_exist(user_id: int, *, db: AsyncSession) -> bool:
+    return await db.scalar(select(UserTable.user_id).where(UserTable.user_id == user_id)) is not None
+
+async def create_user(payload: RegisterPayload) -> int:
+    return await _insert_user(payload, await generate_hash_async(payload.password))
 
 @with_postgres
-def create_user(payload: RegisterPayload, *, db: Session) -> int:
+async def _insert_user(payload: RegisterPayload, password_hash: str, *, db: AsyncSession) -> int:
     user: UserTable = UserTable(full_name=payload.full_name)
-    user.account = UserAccount(username=payload.username, password_hash=generate_hash(payload.password), role=Roles.USER.value)
+    user.account = UserAccount(username=payload.username, password_hash=password_hash, role=Roles.USER.value)
     # user.phone_numbers = UserPhoneNumber(phone_number=payload.phone_number)
 
     try:
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.flush()
+        after_commit(db, UserParams.invalidate_counts)
         return user.user_id
 
-    except NotNullViolation as e:
-        db.rollback()
-        log_db_error(e)
-        raise InternalServerError("Database error while creating user")
-
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
 
         # noinspection SpellCheckingInspection
         if getattr(e.orig, 'pgcode', None) == "23505":
             raise Conflict("Username already exists")
 
+        log_db_error(e)
         raise InternalServerError("Database error while creating user")
 
 
 @with_postgres
-def get_role(user_id: int, *, db: Session) -> Roles:
-    data = db.query(UserAccount.role).filter(UserAccount.user_id == user_id).one_or_none()
+async def get_role(user_id: int, *, db: AsyncSession) -> Roles:
+    role = await db.scalar(select(UserAccount.role).where(UserAccount.user_id == user_id))
+    if role is None:
+        raise NotFound("User not found")
+    return Roles(role)
+
+
+@with_postgres
+async def get_active_role(user_id: int, *, db: AsyncSession) -> Roles:
+    """Role of the user, refusing disabled accounts. Used before issuing new credentials."""
+    data = (await db.execute(
+        select(UserAccount.role, UserAccount.is_active).where(UserAccount.user_id == user_id)
+    )).one_or_none()
     if data is None:
         raise NotFound("User not found")
+    elif data.is_active is False:
+        raise Forbidden("Account is disabled")
     return Roles(data.role)
 
 
 @with_postgres
-def _update_role(user_id: int, role: Roles, *, db: Session) -> None:
+async def _update_role(user_id: int, role: Roles, *, db: AsyncSession) -> None:
     try:
-        db.query(UserAccount).filter(UserAccount.user_id == user_id).update({"role": role})
-        db.commit()
+        await db.execute(update(UserAccount).where(UserAccount.user_id == user_id).values(role=role))
     except IntegrityError as e:
-        db.rollback()
+        await db.rollback()
         log_db_error(e.detail)
         raise InternalServerError("Database error while updating role")
+    # Caches must not be invalidated before the new role is visible to other workers
+    after_commit(db, lambda: _propagate_role(user_id, role))
+
+
+async def _propagate_role(user_id: int, role: Roles) -> None:
+    await update_session_role(user_id, role)
+    await revoke_user_tokens(user_id)
+    await invalidate_user(user_id)
+    await UserParams.invalidate_counts()  # listings filter on the role
 
 
 @with_postgres
-def set_owner_role(user_id: int, current_user_id: int, *, db: Session) -> None:
-    current_user_role = get_role(current_user_id, db=db)
+async def set_owner_role(user_id: int, current_user_id: int, *, db: AsyncSession) -> None:
+    current_user_role = await get_role(current_user_id, db=db)
 
     if current_user_role != Roles.OWNER:
         raise Forbidden("You are not allowed to do this")
 
-    _update_role(user_id=current_user_id, role=Roles.ADMIN, db=db)
-    _update_role(user_id=user_id, role=Roles.OWNER, db=db)
+    await _update_role(user_id=current_user_id, role=Roles.ADMIN, db=db)
+    await _update_role(user_id=user_id, role=Roles.OWNER, db=db)
 
 
 @with_postgres
-def set_admin_role(user_id: int, current_user_id: int, *, db: Session) -> None:
-    current_user_role = get_role(current_user_id, db=db)
-    target_user_role = get_role(user_id, db=db)
+async def set_admin_role(user_id: int, current_user_id: int, *, db: AsyncSession) -> None:
+    current_user_role = await get_role(current_user_id, db=db)
+    target_user_role = await get_role(user_id, db=db)
 
     if current_user_role < Roles.ADMIN:
         raise Forbidden("You are not allowed to do this")
@@ -165,13 +235,13 @@ def set_admin_role(user_id: int, current_user_id: int, *, db: Session) -> None:
     elif target_user_role == Roles.ADMIN:
         raise BadRequest("The person already has admin role")
 
-    _update_role(user_id=user_id, role=Roles.ADMIN, db=db)
+    await _update_role(user_id=user_id, role=Roles.ADMIN, db=db)
 
 
 @with_postgres
-def set_manager_role(user_id: int, current_user_id: int, *, db: Session) -> None:
-    current_user_role = get_role(current_user_id, db=db)
-    target_user_role = get_role(user_id, db=db)
+async def set_manager_role(user_id: int, current_user_id: int, *, db: AsyncSession) -> None:
+    current_user_role = await get_role(current_user_id, db=db)
+    target_user_role = await get_role(user_id, db=db)
 
     if current_user_role < Roles.MANAGER:
         raise Forbidden("You are not allowed to do this")
@@ -182,34 +252,67 @@ def set_manager_role(user_id: int, current_user_id: int, *, db: Session) -> None
     elif target_user_role == Roles.MANAGER:
         raise BadRequest("The person already has manager role")
 
-    _update_role(user_id=user_id, role=Roles.MANAGER, db=db)
+    await _update_role(user_id=user_id, role=Roles.MANAGER, db=db)
 
 
-def set_user_role(user_id: int, current_user_id: int, *, db: Session) -> None:
-    current_user_role = get_role(current_user_id, db=db)
-    target_user_role = get_role(user_id, db=db)
+async def set_user_role(user_id: int, current_user_id: int, *, db: AsyncSession) -> None:
+    current_user_role = await get_role(current_user_id, db=db)
+    target_user_role = await get_role(user_id, db=db)
 
     if target_user_role > current_user_role:
         raise Forbidden("You are not allowed to update role of this person")
     elif target_user_role == Roles.USER:
         raise BadRequest("The person already has user role")
 
-    _update_role(user_id=user_id, role=Roles.USER, db=db)
+    await _update_role(user_id=user_id, role=Roles.USER, db=db)
+
+
+@with_postgres
+async def revoke_sessions(user_id: int, current_user_id: int, *, db: AsyncSession) -> int:
+    """Revokes every session of the user, who has to rank below the current user unless it is themselves."""
+    if user_id != current_user_id:
+        current_user_role = await get_role(current_user_id, db=db)
+        target_user_role = await get_role(user_id, db=db)
+
+        if not target_user_role < current_user_role:
+            raise Forbidden("You are not allowed to revoke sessions of this person")
+
+    return await delete_user_sessions(user_id)
+
+
+@with_postgres
+async def set_account_active(user_id: int, is_active: bool, current_user_id: int, *, db: AsyncSession) -> None:
+    """Enables or disables the account of a user ranked below the current user."""
+    current_user_role = await get_role(current_user_id, db=db)
+    target_user_role = await get_role(user_id, db=db)
+
+    if not target_user_role < current_user_role:
+        raise Forbidden("You are not allowed to update this person")
+
+    await db.execute(update(UserAccount).where(UserAccount.user_id == user_id).values(is_active=is_active))
+    after_commit(db, lambda: _propagate_account_state(user_id, is_active))
+
+
+async def _propagate_account_state(user_id: int, is_active: bool) -> None:
+    await update_session_active(user_id, is_active)
+    await revoke_user_tokens(user_id)
+    await invalidate_user(user_id)
 
 
 @with_postgres
-def update_role(user_id: int, role: Roles, current_user_id: Optional[int] = None, *, db: Session) -> None:
+async def update_role(user_id: int, role: Roles, current_user_id: Optional[int] = None, *, db: AsyncSession) -> None:
     match role:
         case Roles.OWNER:
-            return set_owner_role(user_id, current_user_id, db=db)
+            return await set_owner_role(user_id, current_user_id, db=db)
         case Roles.ADMIN:
-            return set_admin_role(user_id, current_user_id, db=db)
+            return await set_admin_role(user_id, current_user_id, db=db)
         case Roles.MANAGER:
-            return set_manager_role(user_id, current_user_id, db=db)
+            return await set_manager_role(user_id, current_user_id, db=db)
         case Roles.USER:
-            return set_user_role(user_id, current_user_id, db=db)
+            return await set_user_role(user_id, current_user_id, db=db)
         case _:
             raise InternalServerError("Unknown role")
 
 if __name__ == "__main__":
-    print(fetch_user(1).json(), sep="\n")
\ No newline at end of file
+    import asyncio
+    print(asyncio.run(fetch_user(1)).model_dump_json(), sep="\n")
@@ -1,20 +1,47 @@
 # main.py
+import logging
 import time
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.exceptions import RequestValidationError
+from sqlalchemy.exc import SQLAlchemyError
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
 from Exceptions import ResponseError, UnprocessableContent, Unauthorized
-from logger import log_request, log_error
+from database.postgres import request_db, READ_PRIMARY_COOKIE, READ_YOUR_WRITES_SECONDS
+from database.postgres.partitions import start_partition_maintainer
+from logger import log, log_request, log_error, start_audit_writer, stop_audit_writer
 from logger.app import log_critical
 from models.response import Respond
 from routes.api import api_router
 # from routes.utils import router as utils_router
 from routes.auth import router as auth_router
+from modules.reports import stop_report_workers
+from utils.cache import cache_enabled
+from utils.machines import refresh_machine_index
+from utils.session import start_session_sweeper
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    start_audit_writer()
+    cache_enabled()  # subscribes to cache invalidations before the first request
+    stop_session_sweeper = start_session_sweeper()
+    stop_partition_maintainer = start_partition_maintainer()
+    try:
+        await refresh_machine_index()
+    except (SQLAlchemyError, OSError) as e:
+        log(f"Machine index not loaded, retrying on first use: {e}", logging.WARNING)
+    yield
+    stop_report_workers()
+    stop_partition_maintainer.set()
+    stop_session_sweeper.set()
+    stop_audit_writer()
+
+# One database session and transaction per request, shared by every module call it makes
+app = FastAPI(lifespan=lifespan, dependencies=[Depends(request_db)])
 
 # Include auth routes with optional prefix
 app.include_router(auth_router)
@@ -48,4 +75,12 @@ async def log_request_time(request: Request, call_next):
     response = await call_next(request)
     duration = (time.time() - start_time) * 1000
     log_request(request, response.status_code, duration)
+    return response
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    response = await call_next(request)
+    # Keeps the client's reads on the primary until the replica has caught up with its writes
+    if getattr(request.state, "db_wrote", False):
+        response.set_cookie(READ_PRIMARY_COOKIE, "1", max_age=READ_YOUR_WRITES_SECONDS, httponly=True, samesite="lax")
     return response
\ No newline at end of file
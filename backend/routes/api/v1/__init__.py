@@ -2,9 +2,15 @@ from fastapi import APIRouter, Depends
 from utils.authorization import authorize
 
 from .activities import timesheet
+from .admin import admin
+from .machines import machines
+from .reports import reports
 from .users import users
 
 v1 = APIRouter(prefix="/v1", dependencies=[Depends(authorize)])
 
 v1.include_router(timesheet)
-v1.include_router(users)
\ No newline at end of file
+v1.include_router(users)
+v1.include_router(machines)
+v1.include_router(reports)
+v1.include_router(admin)
\ No newline at end of file
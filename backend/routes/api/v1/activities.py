@@ -1,19 +1,32 @@
-from fastapi import APIRouter, Depends, Request
-from starlette.responses import JSONResponse
+from typing import Literal
+
+from fastapi import APIRouter, Depends, Query, Request
+from starlette.responses import JSONResponse, StreamingResponse
 
 from models.request import TimeSheetParams, TimesheetPayload
 from models.response import Respond
-from modules.timesheets import fetch_timesheets, create_timesheet
+from modules.timesheets import fetch_timesheets, create_timesheet, export_timesheets
 from utils.session import get_session_user_id
 
 timesheet = APIRouter(prefix="/timesheets")
 
 @timesheet.get("")
-def get_timesheets(params: TimeSheetParams = Depends()) -> JSONResponse:
-    return Respond.success("Datas fetched successfully", fetch_timesheets(params), params.pagination)
+async def get_timesheets(params: TimeSheetParams = Depends()) -> JSONResponse:
+    return Respond.success("Datas fetched successfully", await fetch_timesheets(params), params.pagination)
+
+@timesheet.get("/export")
+async def get_timesheets_export(
+        params: TimeSheetParams = Depends(),
+        export_format: Literal["csv", "ndjson"] = Query("ndjson", alias="format"),
+) -> StreamingResponse:
+    return StreamingResponse(
+        await export_timesheets(params, export_format),
+        media_type="text/csv" if export_format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="timesheets.{export_format}"'},
+    )
 
 @timesheet.post("", status_code=201)
-def post_timesheets(payload: TimesheetPayload, request: Request) -> JSONResponse:
+async def post_timesheets(payload: TimesheetPayload, request: Request) -> JSONResponse:
     if payload.user_id is None:
-        payload.user_id = get_session_user_id(request)
-    return Respond.created("Activity created successfully", create_timesheet(payload))
\ No newline at end of file
+        payload.user_id = await get_session_user_id(request)
+    return Respond.created("Activity created successfully", await create_timesheet(payload))
\ No newline at end of file
@@ -0,0 +1,32 @@
+from typing import Literal
+
+from fastapi import APIRouter, Query
+from fastapi.params import Depends
+from starlette.responses import JSONResponse
+
+from Enums import Roles
+from database.postgres import get_pool_stats, get_query_stats, reset_query_stats, get_statement_cache_stats
+from models.response import Respond
+from utils.authorization import required_roles
+
+admin = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(required_roles(Roles.ADMIN))])
+
+@admin.get("/pool")
+async def get_pool() -> JSONResponse:
+    return Respond.success("Connection pool stats fetched successfully", get_pool_stats())
+
+@admin.get("/queries")
+async def get_queries(
+        sort_by: Literal["total_ms", "count", "avg_ms", "p50_ms", "p99_ms", "max_ms"] = "total_ms",
+        limit: int = Query(50, ge=1, le=1000),
+) -> JSONResponse:
+    return Respond.success("Query stats fetched successfully", get_query_stats(sort_by, limit))
+
+@admin.delete("/queries")
+async def delete_queries() -> JSONResponse:
+    reset_query_stats()
+    return Respond.success("Query stats reset successfully")
+
+@admin.get("/statements")
+async def get_statements() -> JSONResponse:
+    return Respond.success("Statement cache stats fetched successfully", get_statement_cache_stats())
@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Query
+from starlette.responses import JSONResponse
+
+from models.response import Respond
+from modules.machines import suggest_machines
+
+machines = APIRouter(prefix="/machines", tags=["machines"])
+
+@machines.get("")
+async def get_machines(prefix: str = "", limit: int = Query(10, ge=1, le=100)) -> JSONResponse:
+    return Respond.success("Machines fetched successfully", await suggest_machines(prefix, limit))
@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Path, Request
+from starlette.responses import JSONResponse, Response
+
+from Enums import Roles
+from Exceptions import Forbidden
+from models.models import ReportJob
+from models.request import TimesheetReportPayload
+from models.response import Respond
+from modules.reports import request_timesheet_report, get_report_job, get_report_pdf
+from utils.authorization import authorize, get_user_role
+
+reports = APIRouter(prefix="/reports", tags=["reports"])
+
+JobId = Path(pattern=r"^[0-9a-f]{64}$")
+
+
+async def check_report_access(request: Request, user_id: int) -> None:
+    """Users get their own reports, managers and admins anyone's."""
+    if user_id != await authorize(request) and await get_user_role(request) not in (Roles.MANAGER, Roles.ADMIN, Roles.OWNER):
+        raise Forbidden("You don't have permission to access this report")
+
+def report_response(request: Request, job: ReportJob) -> JSONResponse:
+    data = {**job.model_dump(), "status_url": str(request.url_for("get_report", job_id=job.job_id))}
+    if job.status == "ready":
+        data["download_url"] = str(request.url_for("get_report_pdf", job_id=job.job_id))
+        return Respond.success("Report is ready", data)
+    if job.status == "failed":
+        return Respond.success("Report generation failed", data)
+    return Respond.accepted("Report is being generated", data)
+
+@reports.post("/timesheets")
+async def post_timesheet_report(payload: TimesheetReportPayload, request: Request) -> JSONResponse:
+    user_id = payload.user_id if payload.user_id is not None else await authorize(request)
+    await check_report_access(request, user_id)
+    return report_response(request, await request_timesheet_report(user_id, payload.period))
+
+@reports.get("/{job_id}")
+async def get_report(request: Request, job_id: str = JobId) -> JSONResponse:
+    job = await get_report_job(job_id)
+    await check_report_access(request, job.user_id)
+    return report_response(request, job)
+
+@reports.get("/{job_id}/pdf", name="get_report_pdf")
+async def get_report_pdf_file(request: Request, job_id: str = JobId) -> Response:
+    job = await get_report_job(job_id)
+    await check_report_access(request, job.user_id)
+    # The id is the content address, so it is a strong validator for the PDF
+    etag = f'"{job_id}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=3600"}
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers=headers)
+    headers["Content-Disposition"] = f'attachment; filename="timesheets-{job.user_id}-{job.period}.pdf"'
+    return Response(await get_report_pdf(job_id), media_type="application/pdf", headers=headers)
@@ -5,27 +5,48 @@ from starlette.responses import JSONResponse
 from Enums import Roles
 from Exceptions import Forbidden
 from models.request.params import UserParams
-from models.request.payload import UpdateRolesPayload
+from models.request.payload import UpdateRolesPayload, UpdateAccountStatePayload
 from models.response import Respond
-from modules.users import fetch_users, fetch_user, update_role
+from modules.users import fetch_users, fetch_user, update_role, revoke_sessions, set_account_active
 from utils.authorization import required_roles, authorize
+from utils.session import get_user_sessions
 
 users = APIRouter(prefix="/users", tags=["users"], dependencies=[Depends(required_roles(Roles.ADMIN, Roles.MANAGER))])
 
 @users.get("")
-def get_users(params: UserParams = Depends()) -> JSONResponse:
-    return Respond.success("Users fetched successfully", fetch_users(params), pagination=params.pagination)
+async def get_users(params: UserParams = Depends()) -> JSONResponse:
+    return Respond.success("Users fetched successfully", await fetch_users(params), pagination=params.pagination)
 
 @users.get("/{user_id}")
-def get_user(user_id: int) -> JSONResponse:
-    return Respond.success("User data fetched successfully", fetch_user(user_id))
+async def get_user(user_id: int) -> JSONResponse:
+    return Respond.success("User data fetched successfully", await fetch_user(user_id))
 
 # @users.post("", status_code=201)
 # def post_user() -> JSONResponse:
 #     return Respond.created("User created successfully")
 
 @users.put("/{user_id}/role")
-def put_user_role(user_id: int, payload: UpdateRolesPayload, current_user_id: int = Depends(authorize)) -> JSONResponse:
+async def put_user_role(user_id: int, payload: UpdateRolesPayload, current_user_id: int = Depends(authorize)) -> JSONResponse:
     if user_id == current_user_id:
         raise Forbidden("You cannot update your own role")
-    return Respond.success("User role updated successfully", update_role(user_id, payload.role, current_user_id))
\ No newline at end of file
+    return Respond.success("User role updated successfully", await update_role(user_id, payload.role, current_user_id))
+
+@users.put("/{user_id}/active", dependencies=[Depends(required_roles(Roles.ADMIN))])
+async def put_user_active(user_id: int, payload: UpdateAccountStatePayload, current_user_id: int = Depends(authorize)) -> JSONResponse:
+    if user_id == current_user_id:
+        raise Forbidden("You cannot disable your own account")
+    await set_account_active(user_id, payload.is_active, current_user_id)
+    return Respond.success("User account updated successfully")
+
+@users.get("/{user_id}/sessions", dependencies=[Depends(required_roles(Roles.ADMIN))])
+async def get_sessions(user_id: int) -> JSONResponse:
+    sessions = [
+        # Full session ids are bearer credentials, so only a prefix is exposed
+        {"session": session_id[:8], "expires_at": expires_at}
+        for session_id, expires_at in (await get_user_sessions(user_id)).items()
+    ]
+    return Respond.success("User sessions fetched successfully", sessions)
+
+@users.delete("/{user_id}/sessions", dependencies=[Depends(required_roles(Roles.ADMIN))])
+async def delete_sessions(user_id: int, current_user_id: int = Depends(authorize)) -> JSONResponse:
+    return Respond.success("User sessions revoked successfully", {"revoked": await revoke_sessions(user_id, current_user_id)})
@@ -1,54 +1,72 @@
 
-from fastapi import APIRouter, Request, Response, Depends
+from fastapi import APIRouter, Request, Response, Depends, Header
 
 from Exceptions import BadRequest
 from models.request import LoginPayload, RegisterPayload
 from models.response import Respond
-from modules.users import fetch_user, login_user, create_user, get_api_key, update_api_key
-from utils.authorization import authorize, authorize_by_session
+from modules.users import fetch_user, login_user, create_user, get_api_key, update_api_key, get_active_role
+from utils.authorization import authorize, authorize_by_session, authorize_by_token
 from utils.session import create_session, get_session_user_id, delete_session, SESSION_COOKIE_NAME, is_session_valid
+from utils.tokens import create_tokens, verify_token, get_bearer_token, revoke_token
 
 router = APIRouter(prefix="/v1")
 
 
 @router.post("/login")
-def login(request: Request, response: Response, payload: LoginPayload):
+async def login(request: Request, response: Response, payload: LoginPayload):
     session_id = request.cookies.get(SESSION_COOKIE_NAME)
-    if session_id is not None and is_session_valid(session_id):
+    if session_id is not None and await is_session_valid(session_id):
         raise BadRequest("Existing Session Found")
 
-    user = login_user(payload.username, payload.password)
-    create_session(user.user_id, response)
+    user = await login_user(payload.username, payload.password)
+    await create_session(user.user_id, user.role, response)
     return Respond.success("Logged in successfully", user, headers=response.headers)
 
 
 @router.post("/register", status_code=201)
-def register(response: Response, payload: RegisterPayload):
-    user_id = create_user(payload)
+async def register(response: Response, payload: RegisterPayload):
+    user_id = await create_user(payload)
     # create_session(user_id, response)
     return Respond.created("Registered successfully", {"user_id": user_id}, headers=response.headers)
 
 
 @router.get("/session")
-def session(request: Request):
-    user_id = get_session_user_id(request)
-    return Respond.success("Session Found Successfully", fetch_user(user_id))
+async def session(request: Request):
+    user_id = await get_session_user_id(request)
+    return Respond.success("Session Found Successfully", await fetch_user(user_id))
 
 
 @router.post("/logout", dependencies=[Depends(authorize_by_session)])
-def logout(request: Request, response: Response):
-    delete_session(request, response)
+async def logout(request: Request, response: Response):
+    await delete_session(request, response)
     return Respond.success("Logged out successfully", headers=response.headers)
 
 @router.get("/api-key", dependencies=[Depends(authorize_by_session)])
-def api_key(request: Request):
-    return Respond.success("API Key Fetched/Generated", get_api_key(get_session_user_id(request)))
+async def api_key(request: Request):
+    return Respond.success("API Key Fetched/Generated", await get_api_key(await get_session_user_id(request)))
 
 @router.patch("/api-key", dependencies=[Depends(authorize_by_session)])
-def change_api_key(request: Request):
-    return Respond.success("API Key Updated", update_api_key(get_session_user_id(request)))
+async def change_api_key(request: Request):
+    return Respond.success("API Key Updated", await update_api_key(await get_session_user_id(request)))
 
 @router.delete("/api-key", dependencies=[Depends(authorize_by_session)])
-def delete_api_key(request: Request):
-    return Respond.success("API Key Deleted", update_api_key(get_session_user_id(request), delete=True))
-
+async def delete_api_key(request: Request):
+    return Respond.success("API Key Deleted", await update_api_key(await get_session_user_id(request), delete=True))
+
+@router.post("/token")
+async def token(payload: LoginPayload):
+    user = await login_user(payload.username, payload.password)
+    return Respond.success("Token issued successfully", create_tokens(user.user_id, user.role))
+
+@router.post("/token/refresh")
+async def refresh_token(authorization: str = Header()):
+    """Exchanges a refresh token for a new token pair. The old refresh token is revoked."""
+    old_token = await verify_token(get_bearer_token(authorization), "refresh")
+    role = await get_active_role(old_token.user_id)
+    await revoke_token(old_token)
+    return Respond.success("Token refreshed successfully", create_tokens(old_token.user_id, role))
+
+@router.post("/token/revoke", dependencies=[Depends(authorize_by_token)])
+async def revoke(request: Request):
+    await revoke_token(request.state.token)
+    return Respond.success("Token revoked successfully")
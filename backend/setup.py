@@ -124,22 +124,24 @@ def add_email(db):
 
 def setup_database(drop_and_recreate=False):
     """
-    Drops all tables (optional) and creates all database tables defined in models.Base.
+    Drops all tables (optional) and brings the schema up to date through the migrations.
 
     Args:
         drop_and_recreate (bool): If True, drops all tables first before creating new ones.
-    Returns:
-        SessionLocal: A configured session factory.
     """
+    from sqlalchemy import text
+    from database.migrations import upgrade, MIGRATIONS_TABLE
     from database.postgres.connection import engine
     from database.postgres.tables import Base
 
     if drop_and_recreate and input("Are you sure you want to drop and recreate all tables? (y/n): ").lower() == "y":
         print("⚠️ Dropping all existing tables...")
         Base.metadata.drop_all(bind=engine)
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP TABLE IF EXISTS {MIGRATIONS_TABLE}"))
 
-    print("📦 Creating tables...")
-    Base.metadata.create_all(bind=engine)
+    print("📦 Applying migrations...")
+    upgrade()
 
     print("✅ Database setup complete.")
 
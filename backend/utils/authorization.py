@@ -1,4 +1,4 @@
-from typing import List, Callable, Annotated
+from typing import List, Callable, Annotated, Optional
 
 from fastapi import Request
 from fastapi.params import Depends
@@ -8,18 +8,23 @@ from Exceptions import Unauthorized, Forbidden, BadRequest
 from logger import log_auth_event
 from Enums import AuthEvents, AuthTypes, Roles
 from modules.users import get_role, validate_api_key
-from utils.session import get_session_user_id, SESSION_COOKIE_NAME
+from utils.cache import role_cache, cache_enabled
+from utils.session import get_session, SESSION_COOKIE_NAME
+from utils.tokens import verify_token, get_bearer_token
 
 
-def authorize(request: Request) -> int:
+async def authorize(request: Request) -> int:
     if hasattr(request.state, "current_user_id"):
         return request.state.current_user_id
 
     if "API-Key" in request.headers:
-        user_id = authorize_by_api_key(request)
+        user_id = await authorize_by_api_key(request)
+
+    elif "Authorization" in request.headers:
+        user_id = await authorize_by_token(request)
 
     elif SESSION_COOKIE_NAME in request.cookies:
-        user_id = authorize_by_session(request)
+        user_id = await authorize_by_session(request)
 
     else:
         raise Unauthorized("Authentication Required")
@@ -28,9 +33,11 @@ def authorize(request: Request) -> int:
     request.state.current_user_id = user_id
     return user_id
 
-def authorize_by_session(request: Request) -> int:
+async def authorize_by_session(request: Request) -> int:
     try:
-        current_user: int = get_session_user_id(request)
+        session = await get_session(request)
+        current_user: int = session.user_id
+        request.state.role = session.role
         log_auth_event(request, AuthTypes.SESSION, AuthEvents.SUCCESS, current_user, "Session Authenticated")
         return current_user
 
@@ -38,22 +45,42 @@ def authorize_by_session(request: Request) -> int:
         log_auth_event(request, AuthTypes.SESSION, AuthEvents.FAILED, None, e.detail)
         raise e
 
-def authorize_by_api_key(request: Request) -> int:
+async def authorize_by_api_key(request: Request) -> int:
     try:
         api_key: str = request.headers.get("API-Key")
-        current_user = validate_api_key(api_key)
+        current_user = await validate_api_key(api_key)
         log_auth_event(request, AuthTypes.API_KEY, AuthEvents.SUCCESS, current_user, "API Key Authenticated")
         return current_user
-    except Unauthorized as e:
+    except (Unauthorized, Forbidden) as e:
         log_auth_event(request, AuthTypes.API_KEY, AuthEvents.FAILED, None, e.detail)
         raise e
 
-def get_user_role(request: Request) -> Roles:
+async def authorize_by_token(request: Request) -> int:
+    try:
+        token = await verify_token(get_bearer_token(request.headers.get("Authorization")))
+        request.state.role = token.role
+        request.state.token = token
+        log_auth_event(request, AuthTypes.TOKEN, AuthEvents.SUCCESS, token.user_id, "Token Authenticated")
+        return token.user_id
+    except Unauthorized as e:
+        event = AuthEvents.TOKEN_EXPIRED if e.detail == "Token expired" else AuthEvents.FAILED
+        log_auth_event(request, AuthTypes.TOKEN, event, None, e.detail)
+        raise e
+
+async def get_user_role(request: Request) -> Roles:
+    if not hasattr(request.state, "role"):
+        # Session and token authentication resolve the role without a lookup
+        current_user_id: int = await authorize(request)
+
     if hasattr(request.state, "role"):
         role: Roles = request.state.role
     else:
-        current_user_id: int = authorize(request)
-        role: Roles = get_role(current_user_id)
+        use_cache = cache_enabled()
+        role: Optional[Roles] = role_cache.get(current_user_id) if use_cache else None
+        if role is None:
+            role = await get_role(current_user_id)
+            if use_cache:
+                role_cache.set(current_user_id, role)
         request.state.role = role
 
     return role
@@ -61,8 +88,8 @@ def get_user_role(request: Request) -> Roles:
 
 def required_roles(*allowed_roles: List[Roles]) -> Callable:
 
-    def check_permission(request: Request) -> bool:
-        role: Roles = get_user_role(request)
+    async def check_permission(request: Request) -> bool:
+        role: Roles = await get_user_role(request)
         if not (role in allowed_roles or role is Roles.ADMIN or role is Roles.OWNER):
             raise Forbidden("You don't have permission to access this resource")
         return True
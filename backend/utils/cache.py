@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from redis.asyncio import Redis as AsyncRedis
+from redis.client import PubSub, PubSubWorkerThread
+
+from database import get_redis_client, get_async_redis_client
+from logger import log
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+SESSION_CACHE_TTL_SECONDS = 30  # must stay below utils.session.SESSION_REFRESH_INTERVAL
+SESSION_CACHE_SIZE = 10_000
+ROLE_CACHE_TTL_SECONDS = 60
+ROLE_CACHE_SIZE = 10_000
+API_KEY_CACHE_TTL_SECONDS = 60
+API_KEY_CACHE_SIZE = 1_000
+
+
+class TTLCache:
+    """
+    A bounded, thread-safe LRU cache whose entries expire after a fixed TTL.
+
+    Lookups on expired entries behave like misses. When the cache is full the least
+    recently used entry is evicted.
+    """
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def pop_values(self, predicate: Callable[[Any], bool]) -> None:
+        """Drops every entry whose value matches the predicate."""
+        with self._lock:
+            for key in [k for k, (_, v) in self._data.items() if predicate(v)]:
+                del self._data[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+session_cache = TTLCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL_SECONDS)  # session_id -> SessionData
+role_cache = TTLCache(ROLE_CACHE_SIZE, ROLE_CACHE_TTL_SECONDS)  # user_id -> Roles
+api_key_cache = TTLCache(API_KEY_CACHE_SIZE, API_KEY_CACHE_TTL_SECONDS)  # api key digest -> user_id
+
+_listener: Optional[PubSubWorkerThread] = None
+_listener_lock = threading.Lock()
+
+
+def _drop_session(session_id: str) -> None:
+    session_cache.pop(session_id)
+
+def _drop_user(user_id: int) -> None:
+    role_cache.pop(user_id)
+    session_cache.pop_values(lambda session: session.user_id == user_id)
+    api_key_cache.pop_values(lambda cached_user_id: cached_user_id == user_id)
+
+def clear_caches() -> None:
+    session_cache.clear()
+    role_cache.clear()
+    api_key_cache.clear()
+
+_handlers: dict[str, list[Callable[[str], None]]] = {
+    "session": [_drop_session],
+    "user": [lambda user_id: _drop_user(int(user_id))],
+}
+
+def on_invalidation(kind: str, handler: Callable[[str], None]) -> None:
+    """Registers a handler for invalidation messages of the given kind published by any worker."""
+    _handlers.setdefault(kind, []).append(handler)
+
+def _on_message(message: dict) -> None:
+    kind, _, key = message["data"].decode().partition(":")
+    for handler in _handlers.get(kind, []):
+        handler(key)
+
+def _on_error(error: Exception, pubsub: PubSub, thread: PubSubWorkerThread) -> None:
+    # Invalidations may have been missed while disconnected; redis-py resubscribes on the next read
+    log(f"Cache invalidation listener error: {error}", logging.WARNING)
+    clear_caches()
+    time.sleep(1)
+
+def cache_enabled() -> bool:
+    """
+    Starts the invalidation listener on first use.
+
+    The local caches are only trusted while the listener is running, otherwise other
+    workers could not tell us about stale entries.
+    """
+    global _listener
+    if _listener is not None and _listener.is_alive():
+        return True
+
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            try:
+                pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{INVALIDATION_CHANNEL: _on_message})
+                _listener = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=_on_error)
+            except Exception as e:
+                log(f"Cache invalidation listener unavailable: {e}", logging.WARNING)
+                clear_caches()
+                return False
+    return True
+
+
+async def publish_invalidation(kind: str, key: str | int, *, r: Optional[AsyncRedis] = None) -> None:
+    await (r or get_async_redis_client()).publish(INVALIDATION_CHANNEL, f"{kind}:{key}")
+
+async def invalidate_session(session_id: str, *, r: Optional[AsyncRedis] = None) -> None:
+    """Drops a session from every worker's cache."""
+    _drop_session(session_id)
+    await publish_invalidation("session", session_id, r=r)
+
+async def invalidate_user(user_id: int, *, r: Optional[AsyncRedis] = None) -> None:
+    """Drops a user's role, sessions and API key from every worker's cache."""
+    _drop_user(user_id)
+    await publish_invalidation("user", user_id, r=r)
@@ -0,0 +1,192 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+gzip comes from zlib, brotli and zstd from the brotli and zstandard packages in
+requirements.txt. An install without them only offers gzip.
+"""
+import zlib
+from os import getenv
+from typing import Callable, Iterable, Optional, Protocol
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MINIMUM_SIZE = int(getenv('COMPRESSION_MINIMUM_SIZE', 1024))  # bytes, smaller bodies aren't worth it
+# Levels trade CPU for size, each is capped at its algorithm's maximum
+COMPRESSION_GZIP_LEVEL = int(getenv('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_LEVEL = int(getenv('COMPRESSION_BROTLI_LEVEL', 4))
+COMPRESSION_ZSTD_LEVEL = int(getenv('COMPRESSION_ZSTD_LEVEL', 3))
+
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript", "application/xml")
+
+
+class Encoder(Protocol):
+    def compress(self, data: bytes, final: bool) -> bytes:
+        """Compresses the data, flushing it so the output so far can be decoded. final ends the stream."""
+        ...
+
+
+class GzipEncoder:
+    def __init__(self, level: int) -> None:
+        self._compressor = zlib.compressobj(min(max(level, 1), 9), zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class BrotliEncoder:
+    def __init__(self, level: int) -> None:
+        self._compressor = brotli.Compressor(quality=min(max(level, 0), 11))
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        return self._compressor.process(data) + (self._compressor.finish() if final else self._compressor.flush())
+
+
+class ZstdEncoder:
+    def __init__(self, level: int) -> None:
+        self._compressor = zstandard.ZstdCompressor(level=min(max(level, 1), 22)).compressobj()
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        mode = zstandard.COMPRESSOBJ_FLUSH_FINISH if final else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return self._compressor.compress(data) + self._compressor.flush(mode)
+
+
+def available_encoders() -> dict[str, Callable[[], Encoder]]:
+    """Encoders of the installed algorithms, preferred first when the client accepts several equally."""
+    encoders: dict[str, Callable[[], Encoder]] = {}
+    if zstandard is not None:
+        encoders["zstd"] = lambda: ZstdEncoder(COMPRESSION_ZSTD_LEVEL)
+    if brotli is not None:
+        encoders["br"] = lambda: BrotliEncoder(COMPRESSION_BROTLI_LEVEL)
+    encoders["gzip"] = lambda: GzipEncoder(COMPRESSION_GZIP_LEVEL)
+    return encoders
+
+
+def negotiate(accept_encoding: str, encodings: Iterable[str]) -> Optional[str]:
+    """The encoding the client weighs highest among ours, ties going to the earlier one. None for identity."""
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name.strip():
+            weights[name.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Pure ASGI middleware compressing text and JSON responses with the encoding negotiated from Accept-Encoding.
+
+    Bodies below minimum_size are sent as they are. Streamed bodies are compressed chunk by
+    chunk as they are sent, each chunk flushed so the client can decode it right away.
+    """
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MINIMUM_SIZE) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoders = available_encoders()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""), self.encoders)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressingResponder(send, encoding, self.encoders[encoding], self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressingResponder:
+    def __init__(self, send: Send, encoding: str, encoder: Callable[[], Encoder], minimum_size: int) -> None:
+        self._send = send
+        self.encoding = encoding
+        self.encoder = encoder
+        self.minimum_size = minimum_size
+        self._start: Optional[Message] = None
+        self._buffer = bytearray()  # body held back until it reaches minimum_size
+        self._compressor: Optional[Encoder] = None
+        self._passthrough = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self._start = message
+            self._passthrough = not _compressible(message)
+            if self._passthrough:
+                await self._send(message)
+            return
+        if message["type"] != "http.response.body" or self._passthrough:
+            await self._send(message)
+            return
+
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+        if self._compressor is None:
+            self._buffer += body
+            if len(self._buffer) < self.minimum_size:
+                if not more_body:
+                    # Sent as is, but a larger body from the same URL would be encoded, so caches must still key on it
+                    MutableHeaders(scope=self._start).add_vary_header("Accept-Encoding")
+                    await self._send(self._start)
+                    await self._send({"type": "http.response.body", "body": bytes(self._buffer)})
+                return
+
+            body = bytes(self._buffer)
+            self._buffer.clear()
+            self._compressor = self.encoder()
+            await self._send_start(self._compressor.compress(body, final=True) if not more_body else None)
+            if not more_body:
+                return
+
+        await self._send({"type": "http.response.body", "body": self._compressor.compress(body, not more_body), "more_body": more_body})
+
+    async def _send_start(self, whole_body: Optional[bytes]) -> None:
+        headers = MutableHeaders(scope=self._start)
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        # The compressed body is a different representation, a strong validator would claim byte equality
+        etag = headers.get("ETag")
+        if etag is not None and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+
+        if whole_body is None:
+            del headers["Content-Length"]
+            await self._send(self._start)
+        else:
+            headers["Content-Length"] = str(len(whole_body))
+            await self._send(self._start)
+            await self._send({"type": "http.response.body", "body": whole_body})
+
+
+def _compressible(start: Message) -> bool:
+    headers = Headers(raw=start["headers"])
+    if start["status"] < 200 or start["status"] in (204, 206, 304) or "content-encoding" in headers:
+        return False
+    return headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
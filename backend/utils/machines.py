@@ -0,0 +1,98 @@
+import asyncio
+import heapq
+import time
+from bisect import bisect_left
+from os import getenv
+from typing import Optional
+
+from sqlalchemy import select
+
+from database import with_postgres
+from database.postgres import AsyncSession
+from database.postgres.tables import MachineTable
+from utils.cache import on_invalidation, publish_invalidation
+
+# Reloads even without an invalidation, in case the listener missed one
+MACHINE_INDEX_MAX_AGE_SECONDS = int(getenv('MACHINE_INDEX_MAX_AGE_SECONDS', 300))
+
+
+def normalize_machine_name(name: str) -> str:
+    return " ".join(name.split())
+
+
+class MachineIndex:
+    """
+    Prefix index over the machine catalogue, a sorted array of lowercased names searched with bisect.
+
+    Every word of a name starts a key of its own, so "lathe" finds "CNC Lathe 2".
+    """
+    def __init__(self, machines: dict[int, str]) -> None:
+        self.names = machines
+        self.ids = {name.lower(): machine_id for machine_id, name in machines.items()}
+        entries = []
+        for machine_id, name in machines.items():
+            words = name.lower().split()
+            entries.extend((" ".join(words[position:]), position, machine_id) for position in range(len(words)))
+        entries.sort()
+        self._keys = [key for key, _, _ in entries]
+        self._entries = [(position, machine_id) for _, position, machine_id in entries]
+
+    def find(self, name: str) -> Optional[int]:
+        return self.ids.get(normalize_machine_name(name).lower())
+
+    def search(self, prefix: str, limit: Optional[int] = None) -> list[int]:
+        """Ids of the machines with a word starting with the prefix, names starting with it first, then shorter names."""
+        prefix = normalize_machine_name(prefix).lower()
+        start = bisect_left(self._keys, prefix)
+        end = bisect_left(self._keys, prefix + "\U0010ffff", start)
+
+        positions: dict[int, int] = {}
+        for position, machine_id in self._entries[start:end]:
+            positions[machine_id] = min(position, positions.get(machine_id, position))
+        def rank(machine_id: int) -> tuple:
+            return positions[machine_id] > 0, len(self.names[machine_id]), self.names[machine_id].lower()
+        return sorted(positions, key=rank) if limit is None else heapq.nsmallest(limit, positions, key=rank)
+
+
+_index = MachineIndex({})
+_loaded_at: Optional[float] = None  # None until loaded, and again after an invalidation
+_invalidations = 0
+_reload_lock = asyncio.Lock()
+
+
+def get_machine_index() -> MachineIndex:
+    """The index as last loaded, see refresh_machine_index."""
+    return _index
+
+@with_postgres
+async def _load_machines(*, db: AsyncSession) -> dict[int, str]:
+    # From the primary, a replica may not have the machine whose creation triggered the reload yet
+    return dict((await db.execute(select(MachineTable.machine_id, MachineTable.name))).tuples().all())
+
+def _is_fresh() -> bool:
+    return _loaded_at is not None and time.monotonic() - _loaded_at < MACHINE_INDEX_MAX_AGE_SECONDS
+
+async def refresh_machine_index() -> MachineIndex:
+    """Reloads the index when it was invalidated or has aged out. Called on startup and before reads."""
+    global _index, _loaded_at
+    if not _is_fresh():
+        async with _reload_lock:
+            if not _is_fresh():
+                invalidations, loaded_at = _invalidations, time.monotonic()
+                _index = MachineIndex(await _load_machines())
+                # An invalidation arriving during the load may not be covered by it, so the index stays stale
+                _loaded_at = loaded_at if invalidations == _invalidations else None
+    return _index
+
+
+def _drop_machine_index(_: str) -> None:
+    global _loaded_at, _invalidations
+    _invalidations += 1
+    _loaded_at = None
+
+async def invalidate_machines() -> None:
+    """Makes every worker reload its machine index."""
+    _drop_machine_index("")
+    await publish_invalidation("machines", "")
+
+on_invalidation("machines", _drop_machine_index)
@@ -1,21 +1,91 @@
+import asyncio
 import bcrypt
+import hashlib
+import hmac
 import secrets
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from os import getenv
+from typing import Callable, TypeVar
+
+from Exceptions import TooManyRequests
+
+T = TypeVar("T")
+
+API_KEY_SECRET = getenv('API_KEY_SECRET')
+if not API_KEY_SECRET:
+    raise EnvironmentError("Missing required environment variable: API_KEY_SECRET")
+
+API_KEY_PREFIX_BYTES = 4
+LEGACY_API_KEY_LENGTH = 43  # secrets.token_urlsafe(32), as keys were issued before they had a prefix
+
+BCRYPT_ROUNDS = int(getenv('BCRYPT_ROUNDS', 12))
+# bcrypt releases the GIL, so a small thread pool hashes in parallel without starving the request threadpool
+HASH_WORKERS = int(getenv('HASH_WORKERS', 2))
+# Hashes allowed to wait for a worker before new ones are rejected
+HASH_QUEUE_LIMIT = int(getenv('HASH_QUEUE_LIMIT', 16))
+
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_LIMIT)
+
+def _submit_hash_job(fn: Callable[..., T], *args) -> Future[T]:
+    """Queues a bcrypt call on the hash pool, failing fast when the pool is saturated."""
+    if not _hash_slots.acquire(blocking=False):
+        raise TooManyRequests("Server is busy, please try again shortly")
+    try:
+        future = _hash_pool.submit(fn, *args)
+    except BaseException:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+    return future
 
 def generate_hash(plaintext_secret: str) -> str:
     """Hashes a plaintext string (password, API key, etc.) using bcrypt."""
-    return bcrypt.hashpw(plaintext_secret.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    return _submit_hash_job(bcrypt.hashpw, plaintext_secret.encode("utf-8"), salt).result().decode("utf-8")
 
 def verify_hash(plaintext_secret: str, hashed_value: str) -> bool:
     """Verifies a plaintext string against a stored bcrypt hash."""
-    return bcrypt.checkpw(plaintext_secret.encode("utf-8"), hashed_value.encode("utf-8"))
+    return _submit_hash_job(bcrypt.checkpw, plaintext_secret.encode("utf-8"), hashed_value.encode("utf-8")).result()
+
+async def generate_hash_async(plaintext_secret: str) -> str:
+    """generate_hash for coroutines, awaits the hash pool instead of blocking the event loop."""
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
+    future = _submit_hash_job(bcrypt.hashpw, plaintext_secret.encode("utf-8"), salt)
+    return (await asyncio.wrap_future(future)).decode("utf-8")
+
+async def verify_hash_async(plaintext_secret: str, hashed_value: str) -> bool:
+    """verify_hash for coroutines, awaits the hash pool instead of blocking the event loop."""
+    future = _submit_hash_job(bcrypt.checkpw, plaintext_secret.encode("utf-8"), hashed_value.encode("utf-8"))
+    return await asyncio.wrap_future(future)
+
+def needs_rehash(hashed_value: str) -> bool:
+    """Whether a stored bcrypt hash was made with a different work factor than BCRYPT_ROUNDS."""
+    # Hashes look like $2b$<rounds>$<salt+digest>
+    return int(hashed_value.split("$")[2]) != BCRYPT_ROUNDS
 
 def generate_random_password() -> str:
     """Generates a random password."""
     return bcrypt.gensalt().decode("utf-8")[-12:]
 
 def generate_api_key() -> str:
-    """Generates a random API key."""
-    return secrets.token_urlsafe(32)
+    """Generates a random API key of the form '<lookup prefix>.<secret>'."""
+    return f"{secrets.token_hex(API_KEY_PREFIX_BYTES)}.{secrets.token_urlsafe(32)}"
+
+def get_api_key_prefix(api_key: str) -> str | None:
+    """Returns the public lookup prefix of an API key, or None if the key is malformed."""
+    prefix, sep, secret = api_key.partition(".")
+    if not sep:
+        # Legacy keys are looked up by their leading characters, migration 0002 stored them that way
+        return api_key[:API_KEY_PREFIX_BYTES * 2] if len(api_key) == LEGACY_API_KEY_LENGTH else None
+    if not secret or len(prefix) != API_KEY_PREFIX_BYTES * 2:
+        return None
+    return prefix
+
+def hash_api_key(api_key: str) -> str:
+    """Keyed SHA-256 digest of an API key. Keys are high-entropy, so a slow hash like bcrypt is unnecessary."""
+    return hmac.new(API_KEY_SECRET.encode("utf-8"), api_key.encode("utf-8"), hashlib.sha256).hexdigest()
 
 
 if __name__ == "__main__":
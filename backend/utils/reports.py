@@ -0,0 +1,61 @@
+"""
+PDF rendering of timesheet reports.
+
+Runs in the report worker processes, so it only depends on reportlab and takes plain data.
+"""
+import io
+from datetime import datetime, time
+from typing import Optional
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+# date, start_time, end_time, machine, description, status, all ISO formatted or plain strings
+ReportRow = tuple[str, str, str, Optional[str], str, Optional[str]]
+
+
+def _hours(start: str, end: str) -> float:
+    start_time, end_time = time.fromisoformat(start), time.fromisoformat(end)
+    day = datetime.min.date()
+    return (datetime.combine(day, end_time) - datetime.combine(day, start_time)).total_seconds() / 3600
+
+
+def render_timesheet_report(employee: str, period: str, rows: list[ReportRow]) -> bytes:
+    """A4 PDF listing the employee's timesheets for the period, one row per entry, with the total hours."""
+    styles = getSampleStyleSheet()
+    cell = styles["BodyText"]
+
+    table_rows = [["Date", "Start", "End", "Hours", "Machine", "Description", "Status"]]
+    total = 0.0
+    for day, start, end, machine, description, status in rows:
+        hours = _hours(start, end)
+        total += hours
+        table_rows.append([
+            day, start[:5], end[:5], f"{hours:.2f}", Paragraph(escape(machine or "-"), cell), Paragraph(escape(description), cell), status or "",
+        ])
+    table_rows.append(["Total", "", "", f"{total:.2f}", "", "", ""])
+
+    table = Table(table_rows, colWidths=[22 * mm, 13 * mm, 13 * mm, 14 * mm, 32 * mm, 66 * mm, 20 * mm], repeatRows=1)
+    table.setStyle(TableStyle([
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold"),
+        ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+        ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ("FONTSIZE", (0, 0), (-1, -1), 8),
+    ]))
+
+    buffer = io.BytesIO()
+    document = SimpleDocTemplate(buffer, pagesize=A4, title=f"Timesheets {employee} {period}",
+                                 leftMargin=10 * mm, rightMargin=10 * mm, topMargin=15 * mm, bottomMargin=15 * mm)
+    document.build([
+        Paragraph(f"Timesheet report, {period}", styles["Title"]),
+        Paragraph(escape(employee), styles["Heading2"]),
+        Spacer(0, 4 * mm),
+        table if rows else Paragraph("No timesheets in this period.", cell),
+    ])
+    return buffer.getvalue()
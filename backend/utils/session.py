@@ -1,21 +1,139 @@
-from typing import Optional, List
-from redis import Redis
+import logging
+import threading
+from typing import Optional, Dict, NamedTuple
+from redis import Redis, RedisError
+from redis.asyncio import Redis as AsyncRedis
 import uuid
 from Exceptions import Unauthorized, BadRequest
 from fastapi import Response, Request
 from Exceptions.ResponseErrors import TooManyRequests
-from database import with_redis, get_redis_client
+from Enums import Roles
+from database import with_redis, get_redis_client, get_async_redis_client
+from logger import log
+from utils.cache import session_cache, cache_enabled, invalidate_session, invalidate_user
 
 SESSION_COOKIE_NAME = "session_id"
 SESSION_EXPIRY_SECONDS = 60 * 5
 MAX_SESSIONS = 3
+# Sliding expiry is only pushed forward once this many seconds have passed since the last refresh
+SESSION_REFRESH_INTERVAL = 60
+SESSION_SWEEP_INTERVAL = 60 * 10
+SESSION_SWEEP_BATCH_SIZE = 500
 
-def create_session(user_id: int, response: Response):
-    if get_session_count(user_id) >= MAX_SESSIONS:
-        raise TooManyRequests(f"The user already has {MAX_SESSIONS} sessions")
+# Each script below replaces a chain of dependent commands with one atomic round trip.
+# Script objects load themselves lazily (EVALSHA, falling back to SCRIPT LOAD), so nothing
+# is sent to Redis at import time.
+
+# user_sessions:<user_id> used to be a SET of session ids. Scripts touching an index convert a leftover
+# one in place first, scoring each id by its session's remaining TTL, rather than failing with WRONGTYPE.
+_CONVERT_INDEX = """
+local function convert_index(key)
+    local kind = redis.call('TYPE', key).ok
+    if kind == 'zset' or kind == 'none' then
+        return
+    end
+    local session_ids = kind == 'set' and redis.call('SMEMBERS', key) or {}
+    redis.call('DEL', key)
+    local now = tonumber(redis.call('TIME')[1])
+    local longest = 0
+    for _, session_id in ipairs(session_ids) do
+        local ttl = redis.call('TTL', 'session:' .. session_id)
+        if ttl > 0 then
+            redis.call('ZADD', key, now + ttl, session_id)
+            longest = math.max(longest, ttl)
+        end
+    end
+    if longest > 0 then
+        redis.call('EXPIRE', key, longest)
+    end
+end
+"""
+
+_LOOKUP_SESSION = get_async_redis_client().register_script(_CONVERT_INDEX + """
+if redis.call('TYPE', KEYS[1]).ok ~= 'hash' then
+    return false
+end
+local session = redis.call('HMGET', KEYS[1], 'user_id', 'role', 'is_active')
+if not session[1] then
+    return false
+end
+if redis.call('TTL', KEYS[1]) < tonumber(ARGV[1]) - tonumber(ARGV[2]) then
+    local index = 'user_sessions:' .. session[1]
+    local now = tonumber(redis.call('TIME')[1])
+    convert_index(index)
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    redis.call('ZADD', index, 'XX', now + tonumber(ARGV[1]), ARGV[3])
+    redis.call('EXPIRE', index, ARGV[1])
+end
+return session
+""")
+
+_CREATE_SESSION = get_async_redis_client().register_script(_CONVERT_INDEX + """
+convert_index(KEYS[1])
+local now = tonumber(redis.call('TIME')[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then
+    return 0
+end
+redis.call('HSET', KEYS[2], 'user_id', ARGV[2], 'role', ARGV[5], 'is_active', ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+""")
+
+_DELETE_SESSION = get_async_redis_client().register_script(_CONVERT_INDEX + """
+local user_id = redis.call('HGET', KEYS[1], 'user_id')
+if user_id then
+    convert_index('user_sessions:' .. user_id)
+    redis.call('ZREM', 'user_sessions:' .. user_id, ARGV[1])
+end
+return redis.call('DEL', KEYS[1])
+""")
+
+_DELETE_USER_SESSIONS = get_async_redis_client().register_script(_CONVERT_INDEX + """
+convert_index(KEYS[1])
+local session_ids = redis.call('ZRANGE', KEYS[1], 0, -1)
+for _, session_id in ipairs(session_ids) do
+    redis.call('DEL', 'session:' .. session_id)
+end
+redis.call('DEL', KEYS[1])
+return #session_ids
+""")
+
+_UPDATE_USER_SESSIONS = get_async_redis_client().register_script(_CONVERT_INDEX + """
+convert_index(KEYS[1])
+local now = tonumber(redis.call('TIME')[1])
+local updated = 0
+for _, session_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], now, '+inf')) do
+    local key = 'session:' .. session_id
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('HSET', key, ARGV[1], ARGV[2])
+        updated = updated + 1
+    end
+end
+return updated
+""")
+
+_PRUNE_INDEX_SOURCE = _CONVERT_INDEX + """
+convert_index(KEYS[1])
+return redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(redis.call('TIME')[1]))
+"""
+_PRUNE_INDEX = get_async_redis_client().register_script(_PRUNE_INDEX_SOURCE)
+_SWEEP_INDEX = get_redis_client().register_script(_PRUNE_INDEX_SOURCE)  # the sweeper thread's blocking client
 
+
+class SessionData(NamedTuple):
+    user_id: int
+    role: Roles
+    is_active: bool
+
+
+async def create_session(user_id: int, role: Roles, response: Response, is_active: bool = True):
     session_id = str(uuid.uuid4())
-    _store_session(session_id, user_id)
+    if not await _store_session(session_id, SessionData(user_id, role, is_active)):
+        raise TooManyRequests(f"The user already has {MAX_SESSIONS} sessions")
+
     response.set_cookie(
         key=SESSION_COOKIE_NAME,
         value=session_id,
@@ -26,68 +144,131 @@ def create_session(user_id: int, response: Response):
     return session_id
 
 @with_redis
-def _store_session(session_id: str, user_id: int, *, r: Redis):
-    r.setex(f"session:{session_id}", SESSION_EXPIRY_SECONDS, user_id)
-    r.sadd(f"user_sessions:{user_id}", session_id)
-    r.expire(f"user_sessions:{user_id}", SESSION_EXPIRY_SECONDS)
+async def _store_session(session_id: str, session: SessionData, *, r: AsyncRedis) -> bool:
+    """Stores the session unless the user is already at MAX_SESSIONS. Returns False when the cap is hit."""
+    return bool(await _CREATE_SESSION(
+        keys=[f"user_sessions:{session.user_id}", f"session:{session_id}"],
+        args=[
+            session_id, session.user_id, SESSION_EXPIRY_SECONDS, MAX_SESSIONS,
+            session.role.value, int(session.is_active),
+        ],
+        client=r,
+    ))
 
-def get_session_user_id(request: Request) -> int:
+async def get_session(request: Request) -> SessionData:
+    """Resolves the session cookie to the user_id and role stored at login, rejecting disabled accounts."""
     session_id = request.cookies.get(SESSION_COOKIE_NAME)
     if not session_id:
         raise BadRequest("Session Not Found")
-    r = get_redis_client()
-    user_id: Optional[bytes] = r.get(f"session:{session_id}")
-    if not user_id:
+
+    use_cache = cache_enabled()
+    if use_cache and (session := session_cache.get(session_id)) is not None:
+        return _check_active(session)
+
+    data: Optional[list[bytes]] = await _LOOKUP_SESSION(
+        keys=[f"session:{session_id}"],
+        args=[SESSION_EXPIRY_SECONDS, SESSION_REFRESH_INTERVAL, session_id],
+        client=get_async_redis_client(),
+    )
+    if not data:
         raise Unauthorized("Session Expired or Invalid", True)
-    user_id: int = int(user_id)
 
-    r.expire(f"session:{session_id}", SESSION_EXPIRY_SECONDS)
-    r.expire(f"user_sessions:{user_id}", SESSION_EXPIRY_SECONDS)
+    user_id, role, is_active = data
+    session = SessionData(int(user_id), Roles(role.decode()), is_active == b"1")
+    if use_cache:
+        session_cache.set(session_id, session)
+    return _check_active(session)
+
+def _check_active(session: SessionData) -> SessionData:
+    if not session.is_active:
+        raise Unauthorized("Account is disabled", True)
+    return session
+
+async def get_session_user_id(request: Request) -> int:
+    return (await get_session(request)).user_id
 
-    return user_id
+@with_redis
+async def update_session_role(user_id: int, role: Roles, *, r: AsyncRedis) -> None:
+    """Rewrites the role on every live session of the user."""
+    await _UPDATE_USER_SESSIONS(keys=[f"user_sessions:{user_id}"], args=["role", role.value], client=r)
+
+@with_redis
+async def update_session_active(user_id: int, is_active: bool, *, r: AsyncRedis) -> None:
+    """Rewrites the account state on every live session of the user."""
+    await _UPDATE_USER_SESSIONS(keys=[f"user_sessions:{user_id}"], args=["is_active", int(is_active)], client=r)
 
 @with_redis
-def get_session_count(user_id: int, *, r: Redis) -> int:
-    return r.scard(f"user_sessions:{user_id}")
+async def get_session_count(user_id: int, *, r: AsyncRedis) -> int:
+    key = f"user_sessions:{user_id}"
+    pipe = r.pipeline()
+    await _PRUNE_INDEX(keys=[key], client=pipe)
+    pipe.zcard(key)
+    return (await pipe.execute())[1]
 
 @with_redis
-def delete_session(request: Request, response: Response, *, r: Redis) -> None:
+async def delete_session(request: Request, response: Response, *, r: AsyncRedis) -> None:
     session_id = request.cookies.get(SESSION_COOKIE_NAME)
     if session_id:
-        user_id: bytes = r.get(f"session:{session_id}")
-        if user_id:
-            r.srem(f"user_sessions:{int(user_id)}", session_id)
-        r.delete(f"session:{session_id}")
+        await _DELETE_SESSION(keys=[f"session:{session_id}"], args=[session_id], client=r)
+        await invalidate_session(session_id, r=r)
     delete_cookie(response)
 
 def delete_cookie(response: Response) -> None:
     response.delete_cookie(SESSION_COOKIE_NAME)
 
 @with_redis
-def is_session_valid(session_id: str, *, r: Redis) -> bool:
+async def is_session_valid(session_id: str, *, r: AsyncRedis) -> bool:
     """Check if a session ID is valid (exists and not expired)."""
-    return r.exists(f"session:{session_id}") == 1
+    return await r.exists(f"session:{session_id}") == 1
 
 @with_redis
-def get_user_sessions(user_id: int, *, r: Redis) -> List[str]:
+async def get_user_sessions(user_id: int, *, r: AsyncRedis) -> Dict[str, int]:
+    """Returns the user's live session ids mapped to their expiry timestamps, pruning expired ones."""
     key = f"user_sessions:{user_id}"
-    session_ids = r.smembers(key)  # returns set of bytes
-    sessions = []
-
-    for session_id in session_ids:
-        session_id_str = session_id.decode()
-        # Check if session still exists (not expired)
-        if r.exists(f"session:{session_id_str}"):
-            sessions.append(session_id_str)
-        else:
-            # Clean up stale session ID reference
-            r.srem(key, session_id_str)
+    pipe = r.pipeline()
+    await _PRUNE_INDEX(keys=[key], client=pipe)
+    pipe.zrange(key, 0, -1, withscores=True)
+    _, sessions = await pipe.execute()
+    return {session_id.decode(): int(expires_at) for session_id, expires_at in sessions}
 
-    return sessions
+@with_redis
+async def delete_user_sessions(user_id: int, *, r: AsyncRedis) -> int:
+    """Revokes every session of the user. Returns the number of sessions removed."""
+    count = await _DELETE_USER_SESSIONS(keys=[f"user_sessions:{user_id}"], client=r)
+    await invalidate_user(user_id, r=r)
+    return count
 
+@with_redis
+def sweep_session_indexes(*, r: Redis) -> int:
+    """Prunes expired session ids from every user's index. Returns the number of entries removed."""
+    removed = 0
+    pipe = r.pipeline(transaction=False)
+    for key in r.scan_iter(match="user_sessions:*", count=SESSION_SWEEP_BATCH_SIZE):
+        _SWEEP_INDEX(keys=[key], client=pipe)
+        if len(pipe) >= SESSION_SWEEP_BATCH_SIZE:
+            removed += sum(pipe.execute())
+    if len(pipe):
+        removed += sum(pipe.execute())
+    return removed
 
-if __name__ == "__main__":
-    print(get_user_sessions(13))
+def _run_session_sweeper(stop: threading.Event) -> None:
+    r = get_redis_client()
+    while not stop.wait(SESSION_SWEEP_INTERVAL):
+        try:
+            # Only one worker sweeps per interval
+            if r.set("session_sweeper_lock", 1, nx=True, ex=SESSION_SWEEP_INTERVAL):
+                removed = sweep_session_indexes(r=r)
+                log(f"Session sweeper removed {removed} expired session references", logging.DEBUG)
+        except RedisError as e:
+            log(f"Session sweeper failed: {e}", logging.WARNING)
 
+def start_session_sweeper() -> threading.Event:
+    """Starts the background sweeper. Setting the returned event stops it."""
+    stop = threading.Event()
+    threading.Thread(target=_run_session_sweeper, args=(stop,), name="session-sweeper", daemon=True).start()
+    return stop
 
 
+if __name__ == "__main__":
+    import asyncio
+    print(asyncio.run(get_user_sessions(13)))
@@ -1,55 +1,203 @@
+import hashlib
+import logging
+import threading
 import time
-from typing import Optional
+import uuid
+from os import getenv
+from typing import NamedTuple, Optional
+
 from jose import JWTError, jwt
+from jose.exceptions import ExpiredSignatureError
+from redis.asyncio import Redis as AsyncRedis
 
+from Enums import Roles
 from Exceptions import Unauthorized
-from modules.users import fetch_user
+from database import with_redis, get_redis_client, get_async_redis_client
+from logger import log
+from utils.cache import on_invalidation, publish_invalidation, cache_enabled
+
+SECRET_KEY = getenv('JWT_SECRET')
+if not SECRET_KEY:
+    raise EnvironmentError("Missing required environment variable: JWT_SECRET")
 
-# You should store this securely (e.g., in environment variables)
-SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 60
+ACCESS_TOKEN_EXPIRE_SECONDS = 15 * 60
+REFRESH_TOKEN_EXPIRE_SECONDS = 7 * 24 * 60 * 60
+
+DENYLIST_KEY = "token_denylist"  # sorted set of revoked jti, scored by token expiry
+CUTOFF_KEY = "token_cutoff"  # hash of user_id -> access tokens issued before this time are rejected
+DENYLIST_SYNC_SECONDS = 30
+
+
+class TokenData(NamedTuple):
+    user_id: int
+    role: Roles
+    jti: str
+    expires_at: int
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter over strings.
+
+    Membership checks can return false positives but never false negatives, so a
+    negative answer is authoritative and a positive one needs confirming elsewhere.
+    """
+    def __init__(self, size_bits: int = 1 << 17, hash_count: int = 7) -> None:
+        self.size_bits = size_bits
+        self.hash_count = hash_count
+        self._bits = bytearray(size_bits // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8]), int.from_bytes(digest[8:])
+        return ((h1 + i * h2) % self.size_bits for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class _Denylist:
+    """Local mirror of the revoked-token denylist and per-user cutoffs, kept in sync from Redis."""
+    def __init__(self) -> None:
+        self.bloom = BloomFilter()
+        self.cutoffs: dict[int, float] = {}
+        self.synced_at: float = 0
+        self._revoked_during_sync: list[str] = []
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def sync(self) -> None:
+        r = get_redis_client()
+        now = int(time.time())
+        self._revoked_during_sync = []
+        pipe = r.pipeline()
+        pipe.zremrangebyscore(DENYLIST_KEY, "-inf", now)
+        pipe.zrange(DENYLIST_KEY, 0, -1)
+        pipe.hgetall(CUTOFF_KEY)
+        _, revoked, cutoffs = pipe.execute()
+
+        bloom = BloomFilter()
+        for jti in revoked:
+            bloom.add(jti.decode())
+        self.bloom = bloom
+        # Revocations that arrived while the new filter was being built
+        for jti in self._revoked_during_sync:
+            bloom.add(jti)
 
-def create_access_token(data: dict, expires_delta: int = None):
-    to_encode = data.copy()
-    print(int(time.time()))
-    expire = int(time.time()) + (expires_delta or ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    print(to_encode)
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        # Cutoffs older than the access token lifetime can no longer reject anything
+        expired = [user_id for user_id, cutoff in cutoffs.items() if float(cutoff) < now - ACCESS_TOKEN_EXPIRE_SECONDS]
+        if expired:
+            r.hdel(CUTOFF_KEY, *expired)
+        self.cutoffs = {int(user_id): float(cutoff) for user_id, cutoff in cutoffs.items() if user_id not in expired}
+        self.synced_at = time.monotonic()
 
-def verify_token(token: str):
+    def _run(self) -> None:
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                log(f"Token denylist sync failed: {e}", logging.WARNING)
+            time.sleep(DENYLIST_SYNC_SECONDS)
+
+    def is_fresh(self) -> bool:
+        """Starts the sync thread on first use. The mirror is only trusted while syncs and invalidations keep arriving."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="token-denylist", daemon=True)
+                    self._thread.start()
+        return cache_enabled() and time.monotonic() - self.synced_at < DENYLIST_SYNC_SECONDS * 2
+
+    def on_revoked(self, jti: str) -> None:
+        self.bloom.add(jti)
+        self._revoked_during_sync.append(jti)
+
+    def on_user_changed(self, user_id: str) -> None:
+        cutoff = get_redis_client().hget(CUTOFF_KEY, user_id)
+        if cutoff is not None:
+            self.cutoffs[int(user_id)] = float(cutoff)
+
+
+_denylist = _Denylist()
+on_invalidation("token", _denylist.on_revoked)
+on_invalidation("user", _denylist.on_user_changed)
+
+
+def _create_token(user_id: int, role: Roles, token_type: str, expires_in: int) -> str:
+    now = time.time()
+    claims = {
+        "sub": str(user_id),
+        "role": role.value,
+        "type": token_type,
+        "jti": uuid.uuid4().hex,
+        # Fractional, so a token issued right after a revocation in the same second isn't caught by its cutoff
+        "iat": now,
+        "exp": int(now) + expires_in,
+    }
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+def create_tokens(user_id: int, role: Roles) -> dict:
+    return {
+        "access_token": _create_token(user_id, role, "access", ACCESS_TOKEN_EXPIRE_SECONDS),
+        "refresh_token": _create_token(user_id, role, "refresh", REFRESH_TOKEN_EXPIRE_SECONDS),
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_SECONDS,
+    }
+
+@with_redis
+async def _is_revoked(jti: str, *, r: AsyncRedis) -> bool:
+    return await r.zscore(DENYLIST_KEY, jti) is not None
+
+async def verify_token(token: str, token_type: str = "access") -> TokenData:
+    """
+    Verifies a token's signature, expiry and type in-process.
+
+    Redis is only consulted when the local denylist is stale or reports a possible revocation.
+    """
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=ALGORITHM)
-        user_id = payload.get("sub")
-        print(payload.get("exp") - int(time.time()))
-        if not user_id:
-            raise JWTError
-        return payload
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except ExpiredSignatureError:
+        raise Unauthorized("Token expired")
     except JWTError:
-        raise Unauthorized("Invalid or expired token")
+        raise Unauthorized("Invalid token")
 
-from fastapi import Header
-from fastapi.security import HTTPBearer
+    if payload.get("type") != token_type:
+        raise Unauthorized("Invalid token")
 
-security = HTTPBearer()
+    data = TokenData(int(payload["sub"]), Roles(payload["role"]), payload["jti"], payload["exp"])
 
+    if _denylist.is_fresh():
+        if token_type == "access" and payload["iat"] < _denylist.cutoffs.get(data.user_id, 0):
+            raise Unauthorized("Token revoked")
+        if data.jti in _denylist.bloom and await _is_revoked(data.jti):
+            raise Unauthorized("Token revoked")
+    else:
+        cutoff = await get_async_redis_client().hget(CUTOFF_KEY, data.user_id)
+        if token_type == "access" and cutoff is not None and payload["iat"] < float(cutoff):
+            raise Unauthorized("Token revoked")
+        if await _is_revoked(data.jti):
+            raise Unauthorized("Token revoked")
 
-def get_current_user(Authorization: Optional[str] = Header(None)):
-    if not Authorization or not Authorization.startswith("Bearer "):
-        raise Unauthorized("Invalid token")
+    return data
 
-    token = Authorization.split(" ")[1]
-    user_id = verify_token(token)["sub"]
-    user = fetch_user(user_id)
-    if not user:
-        raise Unauthorized("User not found")
-    return user
+def get_bearer_token(authorization: Optional[str]) -> str:
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise Unauthorized("Invalid token")
+    return token
 
+@with_redis
+async def revoke_token(token: TokenData, *, r: AsyncRedis) -> None:
+    await r.zadd(DENYLIST_KEY, {token.jti: token.expires_at})
+    _denylist.on_revoked(token.jti)
+    await publish_invalidation("token", token.jti, r=r)
 
-if __name__ == "__main__":
-    tkn = create_access_token({"sub" : "6", "name" : "Alice"})
-    print(tkn)
-    print(verify_token(tkn))
-    print(int(time.time()))
-    print(get_current_user(tkn).username)
\ No newline at end of file
+@with_redis
+async def revoke_user_tokens(user_id: int, *, r: AsyncRedis) -> None:
+    """Rejects every access token issued to the user so far. Refresh tokens stay valid and pick up the new state."""
+    await r.hset(CUTOFF_KEY, str(user_id), time.time())